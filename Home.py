@@ -19,11 +19,18 @@ if not os.path.exists(data_dir):
     os.makedirs(data_dir, mode=0o777, exist_ok=True)
     os.chmod(data_dir, 0o777)
 
+
+@st.cache_resource
+def shared_context(config_path: str, db_path: str) -> FinContext:
+    # one context per database for the whole process, so a new session doesn't load the tables again
+    return FinContext(config_path, db_path)
+
+
 config_path = os.path.join(data_dir, "config.json")
 db_path = os.path.join(data_dir, "test.db")
-# Init context
+# Init context, sessions share the data and only keep their UI state
 if "context" not in st.session_state:
-    st.session_state['context'] = FinContext(config_path, db_path)
+    st.session_state['context'] = shared_context(config_path, db_path)
 context: FinContext = st.session_state['context']
 
 fw.check_all()
@@ -88,7 +95,7 @@ if not cat_list:
     st.info("You haven't specify any category")
 else:
     tabs = st.tabs(cat_list)
+    category_pies = context.category_pies()
     for i, tab in enumerate(tabs):
         with tab:
-            category_pie = context.category_pie(cat_list[i])
-            st.plotly_chart(category_pie, theme="streamlit", use_container_width=True)
+            st.plotly_chart(category_pies[cat_list[i]], theme="streamlit", use_container_width=True)
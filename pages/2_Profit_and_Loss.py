@@ -19,7 +19,7 @@ cur_year = fu.cur_year()
 index = fw.get_year_list().index(cur_year)
 year = st.selectbox("Select year", fw.get_year_list(), index=index, label_visibility="collapsed", key="profit_and_loss_year_selector")
 
-year_data = context.query_period_data(fu.get_date(year, 1), fu.get_date(year, 12)).groupby("DATE").sum()
+year_data = context.query_monthly_summary(fu.get_date(year, 1), fu.get_date(year, 12))
 total_profit = round(year_data["PROFIT"].sum(), 1)
 st.write(f"Total profit: {fu.gen_txt_with_color_and_arrow(total_profit)}")
 profit_list = [round(x, 1) for x in year_data["PROFIT"].tolist()]
@@ -52,7 +52,7 @@ else:
     with cols[0]:
         st.button("Submit",
                   on_click=context.config.account_from_df,
-                  args=(context, df),
+                  args=(df,),
                   type="primary",
                   key="acc_acc_df_submit",
                   use_container_width=True)
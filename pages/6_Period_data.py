@@ -27,8 +27,7 @@ preset_candidates = ["5 years", "3 years", "1 year", "This year", "Custom"]
 preset_result = fw.button_selector("period_data_preset_selector", preset_candidates, 5, 4, preset_candidates)
 
 if view == "Asset":
-    df = context.query_period_data(start_date, end_date)
-    df = df.groupby("DATE").sum().reset_index()
+    df = context.query_monthly_summary(start_date, end_date)
     # accumulate profit
     df["PROFIT"] = df["PROFIT"].cumsum()
     # # accumulate inflow
@@ -7,6 +7,7 @@ from streamlit_extras.row import row
 
 sys.path.append("..")
 from src.context import FinContext
+from src.findatasql import SQLTracer
 import src.fwidgets as fw
 import src.finutils as fu
 
@@ -35,26 +36,34 @@ g_file: st = grid(1, [1, 1], vertical_align="bottom")
 select_list = ["All(zip)", "Asset data", "Money flow", "Account config"]
 selected = g_file.selectbox("Select data you want to download", select_list, key="cicada_tool_select_download_data")
 
+# tables are exported only when asked, the export is kept until data changes
+exports = ["zip", "asset", "tran", None]
+export = exports[select_list.index(selected)]
 if selected == select_list[0]:
-    selected_data = context.get_zip_data()
+    get_data = context.get_zip_data
     file_name = f"cfs-data-{fu.cur_date()}.zip"
     mime = None
 elif selected == select_list[1]:
-    selected_data = context.get_asset_data()
+    get_data = context.get_asset_data
     file_name = f"cfs-asset-data-{fu.cur_date()}.txt"
     mime = "text/csv"
 elif selected == select_list[2]:
-    selected_data = context.get_tran_data()
+    get_data = context.get_tran_data
     file_name = f"cfs-tran-data-{fu.cur_date()}.txt"
     mime = "text/csv"
 elif selected == select_list[3]:
-    selected_data = context.config.to_json()
+    get_data = context.config.to_json
     file_name = f"cfs-account-config-{fu.cur_date()}.json"
     mime = "application/json"
 
-g_file.download_button(label="**Download your data**", data=selected_data, file_name=file_name, mime=mime, type="primary", use_container_width=True)
+if export is None or context.export_ready(export):
+    g_file.download_button(label="**Download your data**", data=get_data(), file_name=file_name, mime=mime, type="primary", use_container_width=True)
+elif g_file.button("**Prepare your data**", key="prepare_download_button", type="primary", use_container_width=True):
+    with st.spinner("Preparing your data"):
+        get_data()
+    st.rerun()
 
-load_dias = [fw.load_from_zipped_dia, fw.load_from_csv_dia, None, None]
+load_dias = [fw.load_from_zipped_dia, fw.load_from_csv_dia, fw.load_tran_from_csv_dia, None]
 if g_file.button("**Upload your file**", key="upload files", use_container_width=True):
     dia = load_dias[select_list.index(selected)]
     if dia is None:
@@ -75,3 +84,34 @@ st.write("#### Tools")
 g_tools: st = grid(2, vertical_align="bottom")
 if g_tools.button("**Reset tran ID**", key="reset_tran_id_button", use_container_width=True):
     fw.confirm_dia(FinContext.reindex_tran_id, (context,), "You are reseting your tran ID")
+
+if g_tools.button("**Rebuild monthly summary**", key="rebuild_monthly_summary_button", use_container_width=True):
+    context.rebuild_monthly_summary()
+    st.toast("Monthly summary is rebuilt")
+
+if not context.month_key() and g_tools.button("**Store dates as month keys**", key="convert_month_key_button", use_container_width=True):
+    fw.confirm_dia(FinContext.convert_to_month_key, (context,), "You are converting DATE of your tables to integer month keys")
+
+st.write("#### SQL diagnostics")
+tracer: SQLTracer = context.get_sql_tracer()
+g_trace: st = grid(3, vertical_align="bottom")
+level_names = list(SQLTracer.LEVELS.keys())
+level_index = list(SQLTracer.LEVELS.values()).index(tracer.level)
+level = g_trace.selectbox("Trace level", level_names, index=level_index, key="sql_trace_level_select")
+sample_rate = g_trace.number_input("Sample rate", min_value=0.0, max_value=1.0, value=float(tracer.sample_rate), step=0.1,
+                                   key="sql_trace_sample_input")
+tracer.level = SQLTracer.LEVELS[level]
+tracer.sample_rate = sample_rate
+if g_trace.button("**Clear trace**", key="sql_trace_clear_button", use_container_width=True):
+    tracer.clear()
+
+with st.expander("Statement timing"):
+    st.dataframe(tracer.histogram_df(), use_container_width=True)
+with st.expander("Latest statements"):
+    st.dataframe(tracer.records_df().iloc[::-1], hide_index=True, use_container_width=True)
+
+st.write("#### Memory usage")
+with st.expander("Memory usage of the shared context"):
+    usage_df = context.memory_usage()
+    st.write(f"Total: {usage_df['BYTES'].sum() / 1024:,.1f} KB")
+    st.dataframe(usage_df, hide_index=True, use_container_width=True)
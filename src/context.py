@@ -7,9 +7,11 @@ import numpy as np
 import plotly.graph_objects as go
 import plotly.express as px
 from pathlib import Path
+from cachetools import LRUCache
 
 from src.findata import *
 from src.findatasql import *
+from src.findatasql import SQLTracer
 import src.finutils as fu
 from src.st_utils import FinLogger
 from src.finconfig import AssetItem, FinConfig
@@ -17,9 +19,28 @@ from src.finconfig import AssetItem, FinConfig
 
 class FinContext:
 
+    SNAPSHOT_CACHE_SIZE = 64
+
     def __init__(self, config_path: str, db_path: str):
-        self.config = FinConfig(config_path)
         self.data = FinDataContext(db_path)
+        # the config shares the lock of data, snapshots made under it see a consistent config and data
+        self.config = FinConfig(config_path, lock=self.data.lock)
+        # snapshots and aggregates by date, valid for one version of asset data and config
+        self._snapshot_cache = LRUCache(maxsize=FinContext.SNAPSHOT_CACHE_SIZE)
+        self._snapshot_cache_version = None
+        # exported files by name, with the versions of data and config they were made of
+        self._exports: dict[str, tuple[tuple, bytes]] = {}
+
+    def _cached(self, key: tuple, func):
+        # the context may be shared by sessions, the cache is guarded by the data lock, which the config shares
+        with self.data.lock:
+            version = (self.data.asset_version(), self.config.version)
+            if version != self._snapshot_cache_version:
+                self._snapshot_cache.clear()
+                self._snapshot_cache_version = version
+            if key not in self._snapshot_cache:
+                self._snapshot_cache[key] = func()
+            return self._snapshot_cache[key]
 
     def validate(self):
         return self.data.validate()
@@ -28,6 +49,15 @@ class FinContext:
         self.data.clear_db()
         self.data.init_db()
 
+    def close(self):
+        self.data.close()
+
+    def month_key(self) -> bool:
+        return self.data.month_key()
+
+    def convert_to_month_key(self):
+        self.data.convert_to_month_key()
+
     def reset_asset(self):
         self.data.reset_asset_table()
 
@@ -47,6 +77,21 @@ class FinContext:
     def query_tran_info(self) -> pd.DataFrame:
         return self.data.query_tran_info()
 
+    def get_sql_tracer(self) -> SQLTracer:
+        return self.data.get_sql_tracer()
+
+    def memory_usage(self) -> pd.DataFrame:
+        """
+        Memory held by this context, the cached tables and their summaries by column, and the snapshot cache
+
+        Returns:
+            pd.DataFrame: [TABLE, COLUMN, DTYPE, BYTES]
+        """
+        cached = [x for x in self._snapshot_cache.values() if isinstance(x, pd.DataFrame)]
+        snapshot_bytes = sum(int(x.memory_usage(deep=True).sum()) for x in cached)
+        snapshot = pd.DataFrame([["snapshot cache", f"{len(cached)} snapshots", "", snapshot_bytes]], columns=["TABLE", "COLUMN", "DTYPE", "BYTES"])
+        return pd.concat([self.data.memory_usage(), snapshot], ignore_index=True)
+
     def query_subacc_by_date(self, date: str, acc: str, sub: str, use_pre_net_if_not_exist: bool = True) -> pd.DataFrame:
         df: pd.DataFrame = self.data.query_asset(date, acc, sub)
         if not df.empty:
@@ -57,25 +102,33 @@ class FinContext:
             df.loc[df["DATE"] != date, "PROFIT"] = 0
         return df
 
+    def _query_snapshot(self, date: str) -> pd.DataFrame:
+
+        def snapshot():
+            # keep assets in config, in config order
+            assets = pd.DataFrame(self.config.asset_keys(), columns=["ACCOUNT", "SUBACCOUNT"])
+            df = assets.merge(self.data.query_asset_snapshot(date), on=["ACCOUNT", "SUBACCOUNT"], how="inner")
+            return df[self.data.get_asset_cols_name()]
+
+        return self._cached(("snapshot", date), snapshot)
+
     def query_date(self, date: str, use_pre_net_if_not_exist: bool = True) -> pd.DataFrame:
         if not use_pre_net_if_not_exist:
             return self.data.query_asset(date)
+        # the cached snapshot is shared, callers are free to modify their copy
+        return self._query_snapshot(date).copy()
 
-        df = pd.DataFrame(columns=self.data.get_asset_cols_name())
-        for acc in self.config.acc:
-            for sub in self.config.acc[acc].sub_name_list():
-                data = self.query_subacc_by_date(date, acc, sub, use_pre_net_if_not_exist)
-                df = pd.concat([df, data])
-        return df
+    def _query_total(self, date: str, col: str) -> float:
+        return self._cached((col, date), lambda: self._query_snapshot(date)[col].sum())
 
     def query_total_worth(self, date: str) -> float:
-        return self.query_date(date, True)["NET_WORTH"].sum()
+        return self._query_total(date, "NET_WORTH")
 
     def query_total_profit(self, date: str) -> float:
-        return self.query_date(date, True)["PROFIT"].sum()
+        return self._query_total(date, "PROFIT")
 
     def query_total_inflow(self, date: str) -> float:
-        return self.query_date(date, True)["INFLOW"].sum()
+        return self._query_total(date, "INFLOW")
 
     def query_last_asset(self, date: str, acc: str, sub: str) -> pd.DataFrame:
         return self.data.query_last_asset(date, acc, sub)
@@ -84,34 +137,20 @@ class FinContext:
         if not fill_missing:
             return self.data.query_period_asset(start_date, end_date)
 
-        def fill_missing_date(df: pd.DataFrame):
-            # fill missing date, fill missing "NET_WORTH" with previous's "NET_WORTH"
-            # fill missing profit and inflow with 0
-            s, e = self.get_date_range()
-            date_range = fu.date_list(s, e)
-            df = df.set_index('DATE')
-            df = df.reindex(date_range)
-            df['NET_WORTH'] = df['NET_WORTH'].ffill()
-            df['ACCOUNT'] = df['ACCOUNT'].ffill()
-            df['SUBACCOUNT'] = df['SUBACCOUNT'].ffill()
-            df['PROFIT'] = df['PROFIT'].fillna(0)
-            df['INFLOW'] = df['INFLOW'].fillna(0)
-            df = df.reset_index().rename(columns={'index': 'DATE'})
-            return df
-
-        df_list = []
-        for acc in self.config.acc:
-            for sub in self.config.acc[acc].sub_name_list():
-                sub_df = self.data.query_asset(acc=acc, sub=sub)
-                sub_df = fill_missing_date(sub_df)
-                df_list.append(sub_df)
-        df = pd.concat(df_list)
-        df = df[df["DATE"].between(start_date, end_date)]
-        return df
+        # fill missing date, fill missing "NET_WORTH" with previous's "NET_WORTH"
+        # fill missing profit and inflow with 0
+        s, e = self.get_date_range()
+        return self.data.query_asset_panel(fu.date_list(s, e), self.config.asset_keys(), start_date, end_date)
 
     def query_period_tran(self, start_date: str, end_date: str) -> pd.DataFrame:
         return self.data.query_period_tran(start_date, end_date)
 
+    def query_monthly_summary(self, start_date: str = "", end_date: str = "") -> pd.DataFrame:
+        return self.data.query_monthly_summary(start_date, end_date)
+
+    def rebuild_monthly_summary(self):
+        self.data.rebuild_monthly_summary()
+
     def get_date_range(self) -> tuple[str, str]:
         return self.data.query_date_range()
 
@@ -127,7 +166,7 @@ class FinContext:
         return self.config.get_asset(acc_name, sub_name)
 
     def has_asset(self, acc_name: str, sub_name: str) -> bool:
-        return self.get_asset(acc_name, sub_name) is not None
+        return self.config.has_asset(acc_name, sub_name)
 
     def insert_asset(self, date: str, acc: str, sub: str, net: float, inflow: float, profit: float):
         self.data.insert_or_update_asset(date, acc, sub, net, inflow, profit)
@@ -145,6 +184,25 @@ class FinContext:
         self.data.delete_asset(acc_name, sub_name)
         self.config.delete_asset(acc_name, sub_name)
 
+    def reconcile_assets(self, df: pd.DataFrame) -> pd.DataFrame:
+        """
+        Diff the distinct (ACCOUNT, SUBACCOUNT) pairs of uploaded asset data against the config in one set operation
+
+        Returns:
+            pd.DataFrame: [ACCOUNT, SUBACCOUNT, ROWS, EXISTS] of every distinct pair, in order of first appearance
+        """
+        report = df.groupby(["ACCOUNT", "SUBACCOUNT"], sort=False).size().rename("ROWS").reset_index()
+        pairs = pd.MultiIndex.from_frame(report[["ACCOUNT", "SUBACCOUNT"]])
+        report["EXISTS"] = pairs.isin(self.config.asset_keys())
+        return report
+
+    def missing_account_df(self, report: pd.DataFrame) -> pd.DataFrame:
+        """Account table of the pairs of a reconcile_assets report missing in config, categories are left to fill in"""
+        df = report.loc[~report["EXISTS"], ["ACCOUNT", "SUBACCOUNT"]].reset_index(drop=True)
+        for cat in self.config.cat_dict:
+            df[cat] = None
+        return df
+
     def verify_asset_df(self, df: pd.DataFrame) -> tuple[bool, str]:
         asset_cols = self.data.get_asset_cols_name()
         if df.columns.to_list() != asset_cols:
@@ -167,6 +225,10 @@ class FinContext:
     def reindex_tran_id(self):
         self.data.reindex_tran_id()
 
+    def import_tran_csv(self, file, progress=None) -> int:
+        """Append transactions of a csv file, see FinTranData.import_csv"""
+        return self.data.import_tran_csv(file, progress)
+
     def df_to_tran(self, df: pd.DataFrame, append: bool = False):
         self.data.df_to_tran(df, append)
 
@@ -174,32 +236,54 @@ class FinContext:
         self.data.df_to_asset(df, append)
 
     def income_outlay_df(self) -> pd.DataFrame:
-        asset_df = self.data.query_asset()
-        inflow_df = asset_df[["DATE", "INFLOW"]]
-        inflow_df = inflow_df.groupby("DATE").sum().reset_index()
-        tran_df = self.query_tran()
-        income_df = tran_df[tran_df["TYPE"] == "INCOME"].groupby("DATE").sum().reset_index()
-        income_df = income_df[["DATE", "VALUE"]]
-        io_df = pd.merge(inflow_df, income_df, on="DATE", how="left")
-        io_df["INCOME"] = io_df["VALUE"].fillna(0)
+        io_df = self.query_monthly_summary()
         io_df["OUTLAY"] = io_df["INCOME"] - io_df["INFLOW"]
         return io_df[["DATE", "INFLOW", "INCOME", "OUTLAY"]]
 
-    def get_asset_data(self):
-        return self.data.query_asset().to_csv(index=False).encode("utf-8")
-
-    def get_tran_data(self):
-        return self.data.query_tran().to_csv(index=False).encode("utf-8")
-
-    def get_zip_data(self):
-        zip_buffer = io.BytesIO()
-        with zipfile.ZipFile(zip_buffer, "w") as zip:
-            asset_buffer = io.BytesIO(self.get_asset_data())
-            zip.writestr("asset.txt", asset_buffer.getvalue())
-            tran_buffer = io.BytesIO(self.get_tran_data())
-            zip.writestr("flow.txt", tran_buffer.getvalue())
-            zip.writestr("config.json", self.config.to_json())
-        return zip_buffer.getvalue()
+    def _export_version(self) -> tuple:
+        return (self.data.asset_version(), self.data.tran_version(), self.config.version)
+
+    def _export(self, name: str, write) -> bytes:
+        """Bytes written by write to a binary file, made again only after data or config changes"""
+        with self.data.lock:
+            version = self._export_version()
+            if name not in self._exports or self._exports[name][0] != version:
+                buffer = io.BytesIO()
+                write(buffer)
+                self._exports[name] = (version, buffer.getvalue())
+            return self._exports[name][1]
+
+    def export_ready(self, name: str) -> bool:
+        """If the export of name, zip, asset or tran, is made of current data already"""
+        with self.data.lock:
+            return name in self._exports and self._exports[name][0] == self._export_version()
+
+    @staticmethod
+    def _write_csv(write_csv, f):
+        # rows are encoded into f as they are written, f is left open
+        text = io.TextIOWrapper(f, encoding="utf-8", newline="")
+        write_csv(text)
+        text.flush()
+        text.detach()
+
+    def get_asset_data(self) -> bytes:
+        return self._export("asset", lambda f: self._write_csv(self.data.write_asset_csv, f))
+
+    def get_tran_data(self) -> bytes:
+        return self._export("tran", lambda f: self._write_csv(self.data.write_tran_csv, f))
+
+    def get_zip_data(self) -> bytes:
+
+        def write(f):
+            # tables are streamed from database into zip entries, no whole csv is kept in memory
+            with zipfile.ZipFile(f, "w") as zip:
+                with zip.open("asset.txt", "w") as entry:
+                    self._write_csv(self.data.write_asset_csv, entry)
+                with zip.open("flow.txt", "w") as entry:
+                    self._write_csv(self.data.write_tran_csv, entry)
+                zip.writestr("config.json", self.config.to_json())
+
+        return self._export("zip", write)
 
     def load_from_zip_data(self, file):
         with zipfile.ZipFile(file, "r") as z:
@@ -237,39 +321,32 @@ class FinContext:
         fig = px.area(df, x="DATE", y="NET_WORTH", color="ACCOUNT", line_group="SUBACCOUNT")
         return fig
 
-    def category_pie(self, cat: str, date: str = None):
+    def category_distribution(self, date: str = None) -> pd.DataFrame:
+        """NET_WORTH by CATEGORY and LABEL of all categories at date"""
+        date = self.get_latest_date() if date is None else date
 
-        def is_valid_data(row):
-            acc_name = row["ACCOUNT"]
-            sub_name = row["SUBACCOUNT"]
-            return self.has_asset(acc_name, sub_name)
+        def distribution():
+            table = self.config.category_table()
+            df = self._query_snapshot(date)[["ACCOUNT", "SUBACCOUNT", "NET_WORTH"]].merge(table, on=["ACCOUNT", "SUBACCOUNT"])
+            df = df.melt(id_vars="NET_WORTH", value_vars=list(self.config.cat_dict), var_name="CATEGORY", value_name="LABEL")
+            # assets without a label of the category are left out
+            return df.groupby(["CATEGORY", "LABEL"])["NET_WORTH"].sum().reset_index()
 
-        def assign_cat(row):
-            acc_name = row["ACCOUNT"]
-            sub_name = row["SUBACCOUNT"]
-            asset: AssetItem = self.get_asset(acc_name, sub_name)
-            return asset.cats.get(cat)
+        return self._cached(("category", date), distribution)
 
-        # get the latest data
-        date = self.get_latest_date() if date is None else date
-        df = self.query_date(date, True)
+    def category_pie(self, cat: str, date: str = None):
         if cat not in self.config.cat_dict:
             FinLogger.exception(f"{cat} is not in category config")
-
-        # remove invalid data
-        df = df[df.apply(is_valid_data, axis=1)]
-
-        # assign categories
-        df[cat] = df.apply(assign_cat, axis=1)
-
-        # generate chart
-        df_sum = df.groupby(cat)["NET_WORTH"].sum().reset_index()
-
-        # fig = px.pie(df_sum, values="NET_WORTH", names=cat, title=f"{date} CATEGORY {cat} Distribution")
-        fig = go.Figure(go.Pie(labels=df_sum[cat], values=df_sum["NET_WORTH"], textinfo='label+value+percent', showlegend=False))
+        df = self.category_distribution(date)
+        df_sum = df[df["CATEGORY"] == cat]
+        fig = go.Figure(go.Pie(labels=df_sum["LABEL"], values=df_sum["NET_WORTH"], textinfo='label+value+percent', showlegend=False))
         fig.update_layout(margin=dict(l=20, r=20, t=20, b=20))
         return fig
 
+    def category_pies(self, date: str = None) -> dict:
+        """pie chart of every category at date, all out of one aggregation"""
+        return {cat: self.category_pie(cat, date) for cat in self.config.cat_dict}
+
     def profit_waterfall(self, start_date, end_date):
         df = self.query_period_data(start_date, end_date)
         df_sum = df.groupby("DATE")["PROFIT"].sum().reset_index()
@@ -1,12 +1,19 @@
 from __future__ import annotations
 from collections import OrderedDict
+import contextlib
+import hashlib
 import json
 import os
+import tempfile
+import threading
 import pandas as pd
+from src.finutils import synchronized
 from src.st_utils import FinLogger
 
 class AssetItem:
 
+    __slots__ = ("acc", "name", "cats")
+
     def __init__(self, name: str, acc: Account):
         self.acc = acc
         self.name = name
@@ -18,27 +25,17 @@ class AssetItem:
     def to_json(self):
         return {"Name": self.name, "Account": self.acc.name, "Category": self.cats}
 
+    def to_record(self) -> dict:
+        return {"ACCOUNT": self.acc.name, "SUBACCOUNT": self.name, **self.cats}
+
     def to_df(self):
-        data = {
-            "ACCOUNT": self.acc.name,
-            "SUBACCOUNT": self.name,
-        }
-        data.update(self.cats)
-        data = {k: [v] for k, v in data.items()}
-        return pd.DataFrame.from_dict(data)
-
-    def add_to_df(self, df: pd.DataFrame):
-        data = {
-            "ACCOUNT": self.acc.name,
-            "SUBACCOUNT": self.name,
-        }
-        data.update(self.cats)
-        data = [data[x] if x in data else None for x in df.columns]
-        df.loc[len(df)] = data
+        return pd.DataFrame.from_records([self.to_record()])
 
 
 class Account:
 
+    __slots__ = ("name", "assets")
+
     def __init__(self, name: str):
         self.name = name
         self.assets: OrderedDict[str, AssetItem] = OrderedDict()
@@ -50,15 +47,7 @@ class Account:
         return {"Name": self.name}
 
     def to_df(self) -> pd.DataFrame:
-        df = pd.DataFrame()
-        for asset in self.assets.values():
-            df = pd.concat([df, asset.to_df()])
-        print(df)
-        return df
-
-    def add_to_df(self, df: pd.DataFrame):
-        for asset in self.assets.values():
-            asset.add_to_df(df)
+        return pd.DataFrame.from_records([asset.to_record() for asset in self.assets.values()])
 
     def __getitem__(self, sub_name: str) -> AssetItem:
         if sub_name not in self.assets:
@@ -74,20 +63,74 @@ class Account:
 
 class FinConfig:
 
-    def __init__(self, config_path: str):
+    def __init__(self, config_path: str, lock: threading.RLock = None):
+        """
+        Args:
+            lock: lock guarding the config, see synchronized. A context shared by sessions passes the lock of its data,
+                so a reader holding it never sees a config in the middle of a change
+        """
         self.config_path = config_path
+        self.lock = lock if lock is not None else threading.RLock()
         self.config: dict = {}
         self.cat_dict: dict[str, list[str]] = {}
         self.acc: dict[str, Account] = {}
+        # bumped on every change of accounts, assets or categories
+        self.version = 0
+        self._category_table: pd.DataFrame = None
+        self._category_table_version = None
+        # flat indexes of assets updated on every mutation: (account name, asset name) -> asset,
+        # and category -> label -> keys of assets with the label
+        self._assets: dict[tuple[str, str], AssetItem] = {}
+        self._labels: dict[str, dict[str, set[tuple[str, str]]]] = {}
+        # writes are deferred while a batch is open, see batch
+        self._batch_depth = 0
+        self._dirty = False
+        # hash of the content and mtime of the config file as it was last written or loaded
+        self._file_hash = None
+        self._file_mtime = None
         self.load_config_file(config_path)
 
-    def clear_config(self) -> None:
+    def changed(self) -> None:
+        self.version += 1
+
+    def _index_asset(self, asset: AssetItem):
+        key = (asset.acc.name, asset.name)
+        self._assets[key] = asset
+        for cat, label in asset.cats.items():
+            self._labels.setdefault(cat, {}).setdefault(label, set()).add(key)
+
+    def _unindex_asset(self, asset: AssetItem):
+        key = (asset.acc.name, asset.name)
+        self._assets.pop(key, None)
+        for cat, label in asset.cats.items():
+            keys = self._labels.get(cat, {}).get(label)
+            if keys is None:
+                continue
+            keys.discard(key)
+            if not keys:
+                del self._labels[cat][label]
+
+    def _rebuild_indexes(self):
+        self._assets = {}
+        self._labels = {}
+        for acc in self.acc.values():
+            for asset in acc.assets.values():
+                self._index_asset(asset)
+
+    def _reset(self) -> None:
         self.config = {}
         self.cat_dict = {}
         self.acc = {}
+        self._rebuild_indexes()
+
+    @synchronized
+    def clear_config(self) -> None:
+        self._reset()
+        self.changed()
 
+    @synchronized
     def load_from_dict(self, config: dict):
-        self.clear_config()
+        self._reset()
         self.config = config
         if "Categories" in self.config:
             self.cat_dict = self.config["Categories"]
@@ -113,17 +156,58 @@ class FinConfig:
                             FinLogger.exception(f"Found type {type} is not in category {cat}")
                             continue
                         asset.add_cat(cat, type)
+        self._rebuild_indexes()
+        # bumped once the config is loaded, a version never stands for a partly loaded config
+        self.changed()
 
+    @synchronized
     def load_config_file(self, config_path: str):
         if os.path.exists(config_path):
-            with open(config_path) as f:
-                config = json.load(f)
-            self.load_from_dict(config)
+            with open(config_path, "rb") as f:
+                content = f.read()
+            self.load_from_dict(json.loads(content))
+            if config_path == self.config_path:
+                self._file_hash = hashlib.sha256(content).hexdigest()
+                self._file_mtime = os.stat(config_path).st_mtime_ns
         else:
             config = {"Categories": [], "Accounts": [], "Assets": []}
             self.load_from_dict(config)
             self.write_config()
 
+    @synchronized
+    def reload_if_changed(self) -> bool:
+        """Load the config file again if it is modified since it was last written or loaded, a batch in progress is kept"""
+        if self._batch_depth or not os.path.exists(self.config_path):
+            return False
+        if os.stat(self.config_path).st_mtime_ns == self._file_mtime:
+            return False
+        self.load_config_file(self.config_path)
+        return True
+
+    @contextlib.contextmanager
+    def batch(self):
+        """
+        Write the config once for all of the mutations in the with block, batches can be nested.
+        If the block raises, including st.stop and st.rerun which raise BaseException,
+        the mutations are dropped by loading the config file again.
+        """
+        done = False
+        # the lock is held for the whole batch, so a batch of a session doesn't defer writes of other sessions
+        with self.lock:
+            self._batch_depth += 1
+            try:
+                yield self
+                done = True
+            finally:
+                self._batch_depth -= 1
+                if not self._batch_depth:
+                    if not done:
+                        self._dirty = False
+                        self.load_config_file(self.config_path)
+                    elif self._dirty:
+                        self.write_config()
+
+    @synchronized
     def to_dict(self) -> dict:
         config = {}
         if self.cat_dict:
@@ -144,40 +228,84 @@ class FinConfig:
     def to_json(self) -> str:
         return json.dumps(self.to_dict(), indent=4)
 
-    def write_config(self):
-        config = self.to_dict()
-        with open(self.config_path, 'w') as f:
-            json.dump(config, f, indent=4)
-
+    @synchronized
+    def write_config(self) -> bool:
+        """
+        Write the config file atomically through a temporary file, unless it is in a batch or its content is unchanged
+
+        Returns:
+            bool: if the file is written
+        """
+        if self._batch_depth:
+            self._dirty = True
+            return False
+        self._dirty = False
+        content = self.to_json().encode()
+        content_hash = hashlib.sha256(content).hexdigest()
+        if content_hash == self._file_hash and os.path.exists(self.config_path):
+            return False
+
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(self.config_path)), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(content)
+                f.flush()
+                os.fsync(f.fileno())
+            # mkstemp creates the file readable by owner only, keep the mode of the file replaced
+            mode = os.stat(self.config_path).st_mode if os.path.exists(self.config_path) else 0o644
+            os.chmod(tmp_path, mode & 0o777)
+            os.replace(tmp_path, self.config_path)
+        except Exception:
+            os.remove(tmp_path)
+            raise
+        self._file_hash = content_hash
+        self._file_mtime = os.stat(self.config_path).st_mtime_ns
+        return True
+
+    @synchronized
     def clean_up_cat(self):
         for k, v in self.acc.items():
             for sub in v.assets.values():
                 sub.cats = {k: v for k, v in sub.cats.items() if k in self.cat_dict}
+        self._rebuild_indexes()
+        self.changed()
 
+    @synchronized
     def add_asset(self, acc_name: str, sub_name: str, cats: dict):
         if acc_name not in self.acc:
             self.acc[acc_name] = Account(acc_name)
 
         acc = self.acc[acc_name]
+        if acc[sub_name] is not None:
+            self._unindex_asset(acc[sub_name])
         asset = AssetItem(sub_name, acc)
         for k, v in cats.items():
             asset.add_cat(k, v)
         acc.add_asset(asset)
+        self._index_asset(asset)
+        self.changed()
         self.write_config()
 
     def get_asset(self, acc_name: str, sub_name: str) -> AssetItem:
-        if acc_name not in self.acc:
-            return None
-        acc = self.acc[acc_name]
-        return acc[sub_name]
+        return self._assets.get((acc_name, sub_name))
 
+    def has_asset(self, acc_name: str, sub_name: str) -> bool:
+        return (acc_name, sub_name) in self._assets
+
+    def assets_with_label(self, cat: str, label: str) -> set[tuple[str, str]]:
+        """(account name, asset name) of assets labeled label of category cat"""
+        return set(self._labels.get(cat, {}).get(label, ()))
+
+    @synchronized
     def delete_asset(self, acc_name: str, sub_name: str) -> None:
         if acc_name not in self.acc:
             return
         acc = self.acc[acc_name]
         if sub_name not in acc.assets:
             return
+        self._unindex_asset(acc.assets[sub_name])
         del acc.assets[sub_name]
+        self.changed()
         self.write_config()
 
     def acc_name_list(self) -> list[str]:
@@ -186,18 +314,50 @@ class FinConfig:
     def subacc_name_list(self, acc_name: str) -> list[str]:
         return self.acc[acc_name].sub_name_list()
 
-    def account_df(self) -> pd.DataFrame:
-        cols = ["ACCOUNT", "SUBACCOUNT"]
-        cols.extend([k for k in self.cat_dict])
-        df = pd.DataFrame(columns=cols)
-        for k, v in self.acc.items():
-            v.add_to_df(df)
-        return df
+    def asset_keys(self) -> list[tuple[str, str]]:
+        """(account name, asset name) of all assets, in config order"""
+        return [(acc.name, sub) for acc in self.acc.values() for sub in acc.sub_name_list()]
+
+    @synchronized
+    def category_table(self) -> pd.DataFrame:
+        """ACCOUNT, SUBACCOUNT and the label of every category of all assets, rebuilt when the config changes"""
+        if self._category_table_version != self.version:
+            cats = list(self.cat_dict)
+            rows = [[acc.name, asset.name] + [asset.cats.get(cat) for cat in cats]
+                    for acc in self.acc.values() for asset in acc.assets.values()]
+            self._category_table = pd.DataFrame(rows, columns=["ACCOUNT", "SUBACCOUNT"] + cats, dtype=object)
+            self._category_table_version = self.version
+        return self._category_table
 
-    def account_from_df(self, df: pd.DataFrame):
-        for index, row in df.iterrows():
-            acc_name = row["ACCOUNT"]
-            sub_name = row["SUBACCOUNT"]
+    def account_df(self) -> pd.DataFrame:
+        """ACCOUNT, SUBACCOUNT and a column of every category, one row of each asset in config order"""
+        return self.category_table().copy()
+
+    def _changed_assets(self, df: pd.DataFrame) -> tuple[pd.DataFrame, list[str]]:
+        """
+        Rows of an account table whose asset is new or has different labels of the categories in df, compared column-wise.
+        The last row of an asset wins, missing labels are None.
+
+        Returns:
+            tuple[pd.DataFrame, list[str]]: the changed rows with a NEW column, and the categories in df
+        """
+        keys = ["ACCOUNT", "SUBACCOUNT"]
+        cats = [k for k in self.cat_dict if k in df.columns]
+        df = df[keys + cats].drop_duplicates(keys, keep="last").astype(object)
+        df = df.where(df.notna(), None)
+        merged = df.merge(self.category_table()[keys + cats], on=keys, how="left", suffixes=("", "_OLD"), indicator=True)
+        new = merged["_merge"] == "left_only"
+        changed = new.copy()
+        for cat in cats:
+            labels, old_labels = merged[cat], merged[f"{cat}_OLD"]
+            changed |= ~((labels == old_labels) | (labels.isna() & old_labels.isna()))
+        changed_df = merged.loc[changed, keys + cats]
+        changed_df["NEW"] = new[changed]
+        return changed_df, cats
+
+    def _set_assets(self, df: pd.DataFrame, cats: list[str]):
+        """Create or update assets of rows in df with labels of cats"""
+        for acc_name, sub_name, *labels in df[["ACCOUNT", "SUBACCOUNT"] + cats].itertuples(index=False, name=None):
             if acc_name not in self.acc:
                 self.acc[acc_name] = Account(acc_name)
             acc = self.acc[acc_name]
@@ -206,32 +366,34 @@ class FinConfig:
             if asset is None:
                 asset = AssetItem(sub_name, acc)
                 acc.add_asset(asset)
+            else:
+                self._unindex_asset(asset)
 
-            for k, v in row.items():
-                if k in self.cat_dict:
-                    asset.add_cat(k, v)
+            for cat, label in zip(cats, labels):
+                asset.add_cat(cat, label)
+            self._index_asset(asset)
+
+    @synchronized
+    def account_from_df(self, df: pd.DataFrame):
+        """Add or update assets of an account table, only assets new or with changed labels are touched"""
+        changed_df, cats = self._changed_assets(df)
+        if changed_df.empty:
+            return
+        self._set_assets(changed_df, cats)
+        self.changed()
         self.write_config()
 
+    @synchronized
     def add_account_from_df(self, df: pd.DataFrame):
+        """Add the assets of an account table, none of them may exist"""
         if df is None:
             return
-        for index, row in df.iterrows():
-            print(row)
-            acc_name = row["ACCOUNT"]
-            sub_name = row["SUBACCOUNT"]
-            if acc_name not in self.acc:
-                self.acc[acc_name] = Account(acc_name)
-            acc = self.acc[acc_name]
-
-            asset = acc[sub_name]
-            assert (asset is None)
-
-            asset = AssetItem(sub_name, acc)
-            acc.add_asset(asset)
-
-            for k, v in row.items():
-                if k in self.cat_dict:
-                    asset.add_cat(k, v)
+        changed_df, cats = self._changed_assets(df)
+        assert changed_df["NEW"].all() and len(changed_df) == len(df), "Assets to add exist already"
+        if changed_df.empty:
+            return
+        self._set_assets(changed_df, cats)
+        self.changed()
         self.write_config()
 
     def category_df(self):
@@ -239,12 +401,15 @@ class FinConfig:
         cat_df = pd.DataFrame(cat, columns=["Category", "Labels"])
         return cat_df
 
+    @synchronized
     def category_from_df(self, df: pd.DataFrame):
         cat_dict = {}
         for _, row in df.iterrows():
             name: str = row["Category"]
             labels: str = row["Labels"]
             cat_dict[name] = labels.split(',')
-        self.cat_dict = cat_dict
-        self.write_config()
-        self.clean_up_cat()
+        with self.batch():
+            self.cat_dict = cat_dict
+            self.changed()
+            self.clean_up_cat()
+            self.write_config()
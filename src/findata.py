@@ -1,18 +1,157 @@
 from typing import Sequence
+import bisect
+import copy
+import csv
+import logging
+import threading
+import numpy as np
 import pandas as pd
 import streamlit as st
 
 import src.findatasql as fsql
 import src.finutils as fu
 
+logger = logging.getLogger(__name__)
+
+
+class FinDataIndex():
+    """
+    Hash index of a cached table, maps values of cols to row positions in the table.
+    It is built on first lookup, appended rows are added to it, other changes of the indexed columns reset it.
+    """
+
+    EMPTY = np.array([], dtype=np.intp)
+
+    def __init__(self, cols: list[str]):
+        self.cols = cols
+        self._map: dict[tuple, np.ndarray] = None
+
+    def _groups(self, df: pd.DataFrame) -> dict[tuple, np.ndarray]:
+        if df.empty:
+            return {}
+        groups = df.groupby(self.cols, sort=False, observed=True).indices
+        return {(k if isinstance(k, tuple) else (k,)): v for k, v in groups.items()}
+
+    def reset(self):
+        self._map = None
+
+    def append(self, df: pd.DataFrame, start: int):
+        """Add rows of df, which are appended to the table from position start"""
+        if self._map is None:
+            return
+        for k, pos in self._groups(df).items():
+            old = self._map.get(k)
+            self._map[k] = pos + start if old is None else np.concatenate([old, pos + start])
+
+    def lookup(self, df: pd.DataFrame, key: tuple) -> np.ndarray:
+        """Positions of rows in df whose cols equal to key, in table order"""
+        if self._map is None:
+            self._map = self._groups(df)
+        return self._map.get(key, FinDataIndex.EMPTY)
+
+
+# In month key mode DATE is stored as an INTEGER month index (year * 12 + month - 1) in MONTH,
+# and DATE becomes a virtual column generated from it for display
+MONTH_TO_DATE_SQL = "printf('%04d-%02d', MONTH / 12, MONTH % 12 + 1)"
+DATE_TO_MONTH_SQL = "CAST(substr(DATE, 1, 4) AS INTEGER) * 12 + CAST(substr(DATE, 6, 2) AS INTEGER) - 1"
+
+
+def month_col_def() -> fsql.SQLColDef:
+    return fsql.SQLColDef("MONTH", "INTEGER", "NOT NULL", fu.month_index, fu.month_index_series)
+
+
+def date_col_def(month_key: bool) -> fsql.SQLColDef:
+    if month_key:
+        return fsql.SQLColDef("DATE", "TEXT", "", fu.norm_date, fu.norm_date_series, MONTH_TO_DATE_SQL)
+    return fsql.SQLColDef("DATE", "TEXT", "NOT NULL", fu.norm_date, fu.norm_date_series)
+
 
 class FinBaseData():
 
+    # columns indexed for _query, a query uses the index covering the most of its filter columns
+    INDEX_COLS: list[list[str]] = []
+    # repeated text columns kept as categoricals in the cached table, query results have them as plain strings
+    CATEGORY_COLS: list[str] = ["DATE"]
+    # columns of the monthly summary, see summary_values
+    SUMMARY_COLS: list[str] = []
+    # sqlite type to dtype of the cached table, money stays in float64, float32 can't keep cents of large values
+    SQL_DTYPES = {"TEXT": object, "REAL": "float64", "INTEGER": "int64"}
+
     def __init__(self, db: fsql.FinDataSQL, table_name="ACCOUNT"):
         self._name = table_name
         self._db = db
+        # The cached table has the columns in _cols, followed by MONTH, the month index of DATE, in both storage modes.
+        # Range scans, as-of lookups and sorts of the cache run on MONTH, it is dropped from query results.
         self._df: pd.DataFrame = None
         self._table: fsql.SQLTableDef = None
+        self._cols: list[str] = []
+        self._indexes = [FinDataIndex(cols) for cols in self.INDEX_COLS]
+        # bumped on every change of the cached table, for caches built on top of it
+        self.version = 0
+        # per DATE totals of the cached table, see _summarize
+        self.summary: pd.DataFrame = None
+
+    def set_table(self, table: fsql.SQLTableDef):
+        self._table = table
+        self._cols = [x for x in table.cols_name() if x != "MONTH"]
+        self._dtypes = {c: FinBaseData.SQL_DTYPES[self._table[c].type] for c in self._cols}
+        self._dtypes.update({c: "category" for c in self.CATEGORY_COLS})
+        # month indexes fit in int32 until far beyond any ledger
+        self._dtypes["MONTH"] = "int32"
+
+    def month_key(self) -> bool:
+        return "MONTH" in self._table.cols_name()
+
+    def cols_name(self) -> list[str]:
+        return copy.copy(self._cols)
+
+    def _sql_dict(self, d: dict) -> dict:
+        """Keys of d as they are stored, DATE is written to MONTH in month key mode"""
+        if not self.month_key() or "DATE" not in d:
+            return d
+        return {("MONTH" if k == "DATE" else k): v for k, v in d.items()}
+
+    def _sql_df(self, df: pd.DataFrame) -> pd.DataFrame:
+        df = df[self._cols]
+        return df.rename(columns={"DATE": "MONTH"}) if self.month_key() else df
+
+    def _format_df(self, df: pd.DataFrame) -> pd.DataFrame:
+        """Format rows of _cols as they are cached, MONTH is added. Columns are not compacted yet"""
+        new_df = pd.DataFrame({c: self._table[c].affinity_col(df[c]) for c in self._cols}, index=df.index)
+        new_df["MONTH"] = fu.month_index_series(new_df["DATE"])
+        return new_df
+
+    def _compact(self, df: pd.DataFrame) -> pd.DataFrame:
+        """Convert df to the dtypes of the cached table, categories of the cached table are extended to cover df"""
+        df = df.astype({k: v for k, v in self._dtypes.items() if v != "category"})
+        for col in self.CATEGORY_COLS:
+            if self._df is None or not isinstance(self._df[col].dtype, pd.CategoricalDtype):
+                df[col] = df[col].astype("category")
+                continue
+            cats = self._df[col].cat.categories
+            missing = pd.Index(df[col].unique()).difference(cats)
+            if len(missing):
+                self._df[col] = self._df[col].cat.add_categories(missing)
+                cats = self._df[col].cat.categories
+            df[col] = pd.Categorical(df[col], categories=cats)
+        return df
+
+    def _output(self, df: pd.DataFrame) -> pd.DataFrame:
+        """Rows of the cached table as returned by queries, without MONTH and with plain string columns"""
+        return df[self._cols].astype({c: object for c in self.CATEGORY_COLS})
+
+    def memory_usage(self) -> pd.DataFrame:
+        """
+        Returns:
+            pd.DataFrame: [TABLE, COLUMN, DTYPE, BYTES] of every column of the cached table and its summary
+        """
+        rows = []
+        for name, df in [(self._name, self._df), (f"{self._name} summary", self.summary)]:
+            if df is None:
+                continue
+            usage = df.memory_usage(deep=True)
+            rows += [[name, c, str(df[c].dtype) if c in df else "", int(usage[c])] for c in usage.index]
+        return pd.DataFrame(rows, columns=["TABLE", "COLUMN", "DTYPE", "BYTES"])
 
     def validate(self):
         if self._df is None:
@@ -20,7 +159,7 @@ class FinBaseData():
                 tables = db.get_tables()
             if self._name not in [x[0] for x in tables]:
                 return False
-            self._df = self.load_from_db()
+            self.load_from_db()
 
         return True
 
@@ -28,8 +167,60 @@ class FinBaseData():
         with self._db as db:
             r = db.query_all(self._table)
 
-        cols = self._table.cols_name()
-        self._df = pd.DataFrame(r, columns=cols)
+        df = pd.DataFrame(r, columns=self._table.cols_name())
+        if "MONTH" not in df:
+            df["MONTH"] = fu.month_index_series(df["DATE"])
+        self._df = None
+        self._df = self._compact(df[self._cols + ["MONTH"]])
+        self._table_changed()
+        self.rebuild_summary()
+
+    def invalidate(self):
+        """Drop the cached table and load it from database again"""
+        self.load_from_db()
+
+    def write_csv(self, f, chunk_size: int = fsql.FinDataSQL.CHUNK_SIZE):
+        """Write _cols of the table to text file f as csv, rows are streamed from database chunk by chunk"""
+        writer = csv.writer(f, lineterminator="\n")
+        writer.writerow(self._cols)
+        with self._db as db:
+            for rows in db.iter_rows(self._cols, self._table, chunk_size):
+                writer.writerows(rows)
+
+    def summary_values(self, df: pd.DataFrame) -> pd.DataFrame:
+        """Values of rows in df summed by DATE in the summary, columns are SUMMARY_COLS"""
+        return pd.DataFrame(index=df.index)
+
+    def _summarize(self, added: pd.DataFrame = None, removed: pd.DataFrame = None) -> pd.DataFrame:
+        """
+        Totals of added rows minus removed rows by DATE, in one groupby, writes summarize a few rows each
+
+        Returns:
+            pd.DataFrame: indexed by DATE, COUNT of rows followed by SUMMARY_COLS
+        """
+        parts = []
+        for df, sign in [(added, 1), (removed, -1)]:
+            if df is None or df.empty:
+                continue
+            values = self.summary_values(df).astype(float) * sign
+            values.insert(0, "COUNT", sign)
+            values.index = pd.Index(df["DATE"].astype(object), name="DATE")
+            parts.append(values)
+        if not parts:
+            empty = pd.DataFrame(columns=["COUNT"] + self.SUMMARY_COLS, index=pd.Index([], dtype=object, name="DATE"))
+            return empty.astype(float).astype({"COUNT": int})
+        summary = pd.concat(parts).groupby(level=0).sum().round(2)
+        return summary.astype({"COUNT": int})
+
+    def rebuild_summary(self):
+        self.summary = self._summarize(self._df)
+
+    def _summary_changed(self, removed: pd.DataFrame = None, added: pd.DataFrame = None):
+        """Apply rows removed from and added to the cached table on the summary"""
+        if self.summary is None:
+            return
+        summary = self.summary.add(self._summarize(added, removed), fill_value=0).round(2).astype({"COUNT": int})
+        self.summary = summary[summary["COUNT"] > 0].sort_index()
 
     def reset(self):
         with self._db as db:
@@ -38,14 +229,101 @@ class FinBaseData():
             db.commit()
         self.load_from_db()
 
+    # The cache helpers below apply a write that is already committed to database on the cached table,
+    # so the cache is kept in sync without loading the whole table again
+    def _cache_filter(self, filter: dict) -> dict:
+        """Values of filter as they are cached, DATE is matched by MONTH"""
+        filter = {k: self._table[k].affinity(v) for k, v in filter.items()}
+        if "DATE" in filter:
+            filter["MONTH"] = fu.month_index(filter.pop("DATE"))
+        return filter
+
+    def _cache_mask(self, filter: dict) -> pd.Series:
+        filter = self._cache_filter(filter)
+        return (self._df[list(filter)] == pd.Series(filter)).all(axis=1)
+
+    def _table_changed(self, cols: Sequence[str] = None):
+        """Reset indexes on changed cols, None for all of the columns, and bump version"""
+        for index in self._indexes:
+            if cols is None or set(cols) & set(index.cols):
+                index.reset()
+        self.version += 1
+
+    def _cache_insert(self, df: pd.DataFrame):
+        if df.empty:
+            return
+        start = self._df.index.max() + 1 if not self._df.empty else 0
+        new_df = self._compact(self._format_df(df))
+        new_df.index = pd.RangeIndex(start, start + len(new_df))
+        for index in self._indexes:
+            index.append(new_df, len(self._df))
+        self._df = new_df if self._df.empty else pd.concat([self._df, new_df])
+        self._table_changed([])
+        self._summary_changed(added=new_df)
+
+    def _cache_update(self, filter: dict, data: dict):
+        mask = self._cache_mask(filter)
+        old_df = self._df[mask].copy()
+        for k, v in data.items():
+            self._df.loc[mask, k] = self._table[k].affinity(v)
+        self._table_changed(data)
+        self._summary_changed(old_df, self._df[mask])
+
+    def _cache_upsert(self, df: pd.DataFrame, keys: list[str]):
+        # same result as calling insert_or_update row by row: the last row of a key wins, existing rows are updated in place
+        keys = ["MONTH" if k == "DATE" else k for k in keys]
+        new_df = self._format_df(df).drop_duplicates(keys, keep="last")
+        new_keys = pd.MultiIndex.from_frame(new_df[keys])
+        old_keys = pd.MultiIndex.from_frame(self._df[keys])
+        value_cols = [c for c in self._cols if c not in keys + ["DATE"]]
+
+        hit = old_keys.isin(new_keys)
+        if hit.any():
+            old_df = self._df[hit].copy()
+            values = new_df.set_index(keys).reindex(old_keys[hit])[value_cols]
+            self._df.loc[hit, value_cols] = values.to_numpy()
+            self._table_changed(value_cols)
+            self._summary_changed(old_df, self._df[hit])
+        self._cache_insert(new_df[~new_keys.isin(old_keys)])
+
+    def _cache_delete(self, filter: dict):
+        mask = self._cache_mask(filter)
+        removed = self._df[mask]
+        self._df = self._df[~mask]
+        # positions of the rows after deleted ones are changed
+        self._table_changed()
+        self._summary_changed(removed=removed)
+
+    def _find_index(self, filter: dict) -> FinDataIndex:
+        candidates = [x for x in self._indexes if set(x.cols) <= set(filter)]
+        return max(candidates, key=lambda x: len(x.cols), default=None)
+
+    def _query_rows(self, filter: dict) -> pd.DataFrame:
+        """Same as _query, MONTH is kept"""
+        if not filter:
+            return self._df
+
+        filter = self._cache_filter(filter)
+        index = self._find_index(filter)
+        if index is None:
+            return self._df.loc[(self._df[list(filter)] == pd.Series(filter)).all(axis=1)]
+
+        df = self._df.iloc[index.lookup(self._df, tuple(filter[c] for c in index.cols))]
+        rest = {k: v for k, v in filter.items() if k not in index.cols}
+        if rest:
+            df = df.loc[(df[list(rest)] == pd.Series(rest)).all(axis=1)]
+        return df
+
     def _query(self, filter: dict) -> pd.DataFrame:
-        return self._df.loc[(self._df[list(filter)] == pd.Series(filter)).all(axis=1)]
+        return self._output(self._query_rows(filter))
 
     def _query_period(self, period_filter: dict[str, tuple[any, any]], filter: dict[str, any]) -> pd.DataFrame:
-        df = self._query(filter)
+        df = self._query_rows(filter)
         for col, (start, end) in period_filter.items():
+            if col == "DATE":
+                col, start, end = "MONTH", fu.month_index(start), fu.month_index(end)
             df = df[df[col].between(start, end)]
-        return df
+        return self._output(df)
 
     def query_period(self, start_date: str, end_date: str) -> pd.DataFrame:
         period_filter = {"DATE": (start_date, end_date)}
@@ -57,83 +335,88 @@ class FinBaseData():
             self.reset()
 
         with self._db as db:
-            for _, row in df.iterrows():
-                db.insert_data(row.to_dict(), self._table)
+            db.insert_many(self._sql_df(df), self._table)
             db.commit()
-        self.load_from_db()
+        self._cache_insert(df)
 
 
 class FinAssetData(FinBaseData):
 
-    def __init__(self, db: fsql.FinDataSQL, table_name="SUBACCOUNT"):
-        self._name = table_name
-        self._db = db
-        self._df: pd.DataFrame = None
-        self._table = FinAssetData.get_table_def()
+    INDEX_COLS = [["MONTH", "ACCOUNT", "SUBACCOUNT"], ["ACCOUNT", "SUBACCOUNT"], ["MONTH"]]
+    CATEGORY_COLS = ["DATE", "ACCOUNT", "SUBACCOUNT"]
+    SUMMARY_COLS = ["NET_WORTH", "INFLOW", "PROFIT"]
+
+    def __init__(self, db: fsql.FinDataSQL, table_name="SUBACCOUNT", month_key: bool = False):
+        super().__init__(db, table_name)
+        self.set_table(FinAssetData.get_table_def(month_key))
 
-    def get_table_def() -> fsql.SQLTableDef:
-        COL_DATE = fsql.SQLColDef("DATE", "TEXT", "NOT NULL", fu.norm_date)
+    def get_table_def(month_key: bool = False) -> fsql.SQLTableDef:
+        COL_DATE = date_col_def(month_key)
         COL_ACCOUNT = fsql.SQLColDef("ACCOUNT", "TEXT", "NOT NULL")
         COL_NAME = fsql.SQLColDef("SUBACCOUNT", "TEXT", "NOT NULL")
-        COL_NET_WORTH = fsql.SQLColDef("NET_WORTH", "REAL", "NOT NULL", fu.norm_number)
-        COL_INFLOW = fsql.SQLColDef("INFLOW", "REAL", "NOT NULL", fu.norm_number)
-        COL_PROFIT = fsql.SQLColDef("PROFIT", "REAL", "NOT NULL", fu.norm_number)
-        ASSET_TABLE = fsql.SQLTableDef("SUBACCOUNT", [COL_DATE, COL_ACCOUNT, COL_NAME, COL_NET_WORTH, COL_INFLOW, COL_PROFIT])
+        COL_NET_WORTH = fsql.SQLColDef("NET_WORTH", "REAL", "NOT NULL", fu.norm_number, fu.norm_number_series)
+        COL_INFLOW = fsql.SQLColDef("INFLOW", "REAL", "NOT NULL", fu.norm_number, fu.norm_number_series)
+        COL_PROFIT = fsql.SQLColDef("PROFIT", "REAL", "NOT NULL", fu.norm_number, fu.norm_number_series)
+        cols = [COL_DATE, COL_ACCOUNT, COL_NAME, COL_NET_WORTH, COL_INFLOW, COL_PROFIT]
+        date = "DATE"
+        if month_key:
+            cols.append(month_col_def())
+            date = "MONTH"
+        # the unique key also serves lookups by DATE
+        indexes = [fsql.SQLIndexDef(f"SUBACCOUNT_ACC_SUB_{date}", ["ACCOUNT", "SUBACCOUNT", date])]
+        ASSET_TABLE = fsql.SQLTableDef("SUBACCOUNT", cols, [date, "ACCOUNT", "SUBACCOUNT"], indexes)
         return ASSET_TABLE
 
     def insert_data(self, date: str, acc: str, sub: str, net: float, inflow: float, profit: float):
         data = {x.name: y for x, y in zip(self._table.cols(), [date, acc, sub, net, inflow, profit])}
         with self._db as db:
-            db.insert_data(data, self._table)
+            db.insert_data(self._sql_dict(data), self._table)
             db.commit()
-        self.load_from_db()
+        self._cache_insert(pd.DataFrame([data]))
 
     def update_data(self, date: str, acc: str, sub: str, net: float, inflow: float, profit: float):
         filter = {"DATE": date, "ACCOUNT": acc, "SUBACCOUNT": sub}
         update_data = {"NET_WORTH": net, "INFLOW": inflow, "PROFIT": profit}
         with self._db as db:
-            db.update_data(filter, update_data, self._table)
+            db.update_data(self._sql_dict(filter), update_data, self._table)
             db.commit()
-        self.load_from_db()
+        self._cache_update(filter, update_data)
 
     def insert_or_update(self, date: str, acc: str, sub: str, net: float, inflow: float, profit: float):
         filter = {"DATE": date, "ACCOUNT": acc, "SUBACCOUNT": sub}
         update_data = {"NET_WORTH": net, "INFLOW": inflow, "PROFIT": profit}
         with self._db as db:
-            db.insert_or_update(filter, update_data, self._table)
+            db.insert_or_update(self._sql_dict(filter), update_data, self._table)
             db.commit()
-        self.load_from_db()
+        self._cache_upsert(pd.DataFrame([{**filter, **update_data}]), list(filter))
 
     def batch_insert(self, data: Sequence[list]):
+        df = pd.DataFrame([list(row) for row in data], columns=self._cols)
         with self._db as db:
-            for row in data:
-                data = {x.name: y for x, y in zip(self._table.cols(), row)}
-                db.insert_data(data, self._table)
+            db.insert_many(self._sql_df(df), self._table)
             db.commit()
-        self.load_from_db()
+        self._cache_insert(df)
 
     def batch_insert_or_update(self, data: Sequence[list]):
+        df = pd.DataFrame([list(row) for row in data], columns=self._cols)
         with self._db as db:
-            for row in data:
-                filter = {"DATE": row[0], "ACCOUNT": row[1], "SUBACCOUNT": row[2]}
-                update_data = {"NET_WORTH": row[3], "INFLOW": row[4], "PROFIT": row[5]}
-                db.insert_or_update(filter, update_data, self._table)
+            db.upsert_many(self._sql_df(df), self._table)
             db.commit()
-        self.load_from_db()
+        self._cache_upsert(df, self._table.unique())
 
     def delete_data(self, date: str, acc: str, sub: str):
         filter = {"DATE": date, "ACCOUNT": acc, "SUBACCOUNT": sub}
         with self._db as db:
-            db.delete_data(filter, self._table)
+            db.delete_data(self._sql_dict(filter), self._table)
             db.commit()
-        self.load_from_db()
+        self._cache_delete(filter)
 
     def delete_asset(self, acc: str, sub: str):
         filter = {"ACCOUNT": acc, "SUBACCOUNT": sub}
         with self._db as db:
-            db.delete_data(filter, self._table)
+            db.delete_data(self._sql_dict(filter), self._table)
             db.commit()
-        self.load_from_db()
+        self._cache_delete(filter)
 
     def query(self, date: str = "", acc: str = "", sub: str = "") -> pd.DataFrame:
         filter_dict = {}
@@ -147,71 +430,160 @@ class FinAssetData(FinBaseData):
         return self._query(filter=filter_dict)
 
     def query_last(self, date: str, acc: str, sub: str) -> pd.DataFrame:
-        df = self.query(acc=acc, sub=sub)
+        df = self._query_rows({"ACCOUNT": acc, "SUBACCOUNT": sub})
         if df.empty:
-            return pd.DataFrame(columns=df.columns)
+            return pd.DataFrame(columns=self._cols)
 
         # Filter for dates less than the given date
-        df_filtered = df[df['DATE'] < date]
+        df_filtered = df[df["MONTH"] < fu.month_index(date)]
         if df_filtered.empty:
-            return pd.DataFrame(columns=df.columns)
+            return pd.DataFrame(columns=self._cols)
 
         # Get the row with the maximum date
-        max_date = df_filtered['DATE'].max()
-        result = df_filtered[df_filtered['DATE'] == max_date]
-        return result
+        max_month = df_filtered["MONTH"].max()
+        result = df_filtered[df_filtered["MONTH"] == max_month]
+        return self._output(result)
+
+    def query_snapshot(self, date: str) -> pd.DataFrame:
+        """
+        The last record of every asset on or before date, PROFIT of records carried forward from an earlier date is 0
+
+        Returns:
+            pd.DataFrame: one row per (ACCOUNT, SUBACCOUNT) having any record until date
+        """
+        month = fu.month_index(date)
+        df = self._df[self._df["MONTH"] <= month]
+        df = df.sort_values("MONTH", kind="stable").drop_duplicates(["ACCOUNT", "SUBACCOUNT"], keep="last")
+        df.loc[df["MONTH"] != month, "PROFIT"] = 0
+        return self._output(df)
+
+    def query_panel(self, dates: list[str], assets: list[tuple[str, str]], start_date: str, end_date: str) -> pd.DataFrame:
+        """
+        Records of assets on every date of dates within [start_date, end_date], with missing records filled:
+        NET_WORTH is carried forward from the previous record, INFLOW and PROFIT are 0,
+        ACCOUNT, SUBACCOUNT and NET_WORTH are NaN before the first record of an asset.
+
+        Args:
+            dates (list[str]): sorted and continuous months, records out of it are ignored
+            assets (list[tuple[str, str]]): (ACCOUNT, SUBACCOUNT) to return, rows are ordered by asset then date
+        """
+        df = self._df
+        n_date, n_asset = len(dates), len(assets)
+        # dates are continuous, the position of a date is its distance to the first month
+        date_pos = df["MONTH"].to_numpy() - (fu.month_index(dates[0]) if dates else 0)
+        date_pos[(date_pos < 0) | (date_pos >= n_date)] = -1
+        asset_index = pd.MultiIndex.from_tuples(assets) if assets else pd.MultiIndex.from_arrays([[], []])
+        asset_pos = asset_index.get_indexer(pd.MultiIndex.from_frame(df[["ACCOUNT", "SUBACCOUNT"]]))
+        valid = (date_pos >= 0) & (asset_pos >= 0)
+        date_pos, asset_pos = date_pos[valid], asset_pos[valid]
+
+        # dense (dates x assets) matrices
+        def dense(col: str, fill: float) -> np.ndarray:
+            m = np.full((n_date, n_asset), fill, dtype=float)
+            m[date_pos, asset_pos] = df[col].to_numpy(dtype=float)[valid]
+            return m
+
+        exist = np.zeros((n_date, n_asset), dtype=bool)
+        exist[date_pos, asset_pos] = True
+        # row of the latest record until each date, forward fill NET_WORTH column-wise from it
+        last = np.maximum.accumulate(np.where(exist, np.arange(n_date)[:, None], -1), axis=0)
+        net_worth = dense("NET_WORTH", np.nan)[np.maximum(last, 0), np.arange(n_asset)]
+        net_worth[last < 0] = np.nan
+        inflow = dense("INFLOW", 0)
+        profit = dense("PROFIT", 0)
+
+        # only the requested window is turned into rows, asset major
+        lo = bisect.bisect_left(dates, start_date)
+        hi = bisect.bisect_right(dates, end_date)
+        started = (last >= 0)[lo:hi].T.ravel()
+        acc_names = np.array([x[0] for x in assets], dtype=object)
+        sub_names = np.array([x[1] for x in assets], dtype=object)
+        return pd.DataFrame({
+            "DATE": np.tile(np.array(dates[lo:hi], dtype=object), n_asset),
+            "ACCOUNT": np.where(started, np.repeat(acc_names, hi - lo), np.nan),
+            "SUBACCOUNT": np.where(started, np.repeat(sub_names, hi - lo), np.nan),
+            "NET_WORTH": net_worth[lo:hi].T.ravel(),
+            "INFLOW": inflow[lo:hi].T.ravel(),
+            "PROFIT": profit[lo:hi].T.ravel(),
+        })
+
+    def summary_values(self, df: pd.DataFrame) -> pd.DataFrame:
+        return df[self.SUMMARY_COLS]
 
     def query_date_range(self) -> tuple[str, str]:
         df = self._df
-        s = df["DATE"].min()
-        e = df["DATE"].max()
-        if pd.isna(s):
-            s = fu.norm_date(fu.cur_date())
-        if pd.isna(e):
-            e = fu.norm_date(fu.cur_date())
-        return s, e
+        if df.empty:
+            cur = fu.norm_date(fu.cur_date())
+            return cur, cur
+        return fu.month_str(df["MONTH"].min()), fu.month_str(df["MONTH"].max())
 
     def load_from_df(self, df: pd.DataFrame, append: bool = False):
-        if not append:
-            self.reset()
-            self.batch_insert_or_update(df.to_records(index=False))
-        else:
+        if append:
             self.batch_insert_or_update(df.to_records(index=False))
+            return
 
+        # the table is empty after reset, a plain bulk insert gives the same result as upserting row by row
+        self.reset()
+        df = self._format_df(df.set_axis(self._cols, axis=1))
+        super().load_from_df(df.drop_duplicates(["MONTH", "ACCOUNT", "SUBACCOUNT"], keep="last"), append=True)
 
-class FinTranData(FinBaseData):
 
-    def __init__(self, db: fsql.FinDataSQL, table_name="TRAN"):
-        self._name = table_name
-        self._db = db
-        self._df: pd.DataFrame = None
-        self._table = FinTranData.get_table_def()
+class FinTranData(FinBaseData):
 
-    def get_table_def() -> fsql.SQLTableDef:
+    INDEX_COLS = [["ID"], ["MONTH"]]
+    CATEGORY_COLS = ["DATE", "TYPE"]
+    SUMMARY_COLS = ["INCOME", "OUTLAY"]
+    # ID is digit date * ID_SEQ_SIZE + sequence in the month, a month of more records goes on with
+    # digit date * WIDE_ID_SEQ_SIZE + sequence, which are all above WIDE_ID_START
+    ID_SEQ_SIZE = 10000
+    WIDE_ID_SEQ_SIZE = 10 ** 8
+    WIDE_ID_START = 10 ** 10
+    TYPES = ["INCOME", "OUTLAY"]
+    # columns of an imported csv, NOTE is optional and ID is assigned again
+    IMPORT_COLS = ["DATE", "TYPE", "VALUE", "CAT"]
+    IMPORT_CACHE_ROWS = 50000
+
+    def __init__(self, db: fsql.FinDataSQL, table_name="TRAN", month_key: bool = False):
+        super().__init__(db, table_name)
+        self.set_table(FinTranData.get_table_def(month_key))
+        # next sequence of IDs by month index, filled in from the cached table when a month is first used
+        self._next_seq: dict[int, int] = {}
+
+    def get_table_def(month_key: bool = False) -> fsql.SQLTableDef:
         # TRAN_INCOME_NAME = "INCOME"
         # TRAN_OUTLAY_NAME = "OUTLAY"
         COL_TRAN_ID = fsql.SQLColDef("ID", "INTEGER", "PRIMARY KEY")
-        COL_DATE = fsql.SQLColDef("DATE", "TEXT", "NOT NULL", fu.norm_date)
+        COL_DATE = date_col_def(month_key)
         COL_TRAN_TYPE = fsql.SQLColDef("TYPE", "TEXT", "NOT NULL")
-        COL_TRAN_VALUE = fsql.SQLColDef("VALUE", "REAL", "NOT NULL", fu.norm_number)
+        COL_TRAN_VALUE = fsql.SQLColDef("VALUE", "REAL", "NOT NULL", fu.norm_number, fu.norm_number_series)
         COL_TRAN_CAT = fsql.SQLColDef("CAT", "TEXT", "NOT NULL")
         COL_TRAN_NOTE = fsql.SQLColDef("NOTE", "TEXT", "NOT NULL")
-        TRAN_TABLE = fsql.SQLTableDef("TRAN", [COL_TRAN_ID, COL_DATE, COL_TRAN_TYPE, COL_TRAN_VALUE, COL_TRAN_CAT, COL_TRAN_NOTE])
+        cols = [COL_TRAN_ID, COL_DATE, COL_TRAN_TYPE, COL_TRAN_VALUE, COL_TRAN_CAT, COL_TRAN_NOTE]
+        date = "DATE"
+        if month_key:
+            cols.append(month_col_def())
+            date = "MONTH"
+        indexes = [
+            fsql.SQLIndexDef(f"TRAN_{date}", [date]),
+            fsql.SQLIndexDef(f"TRAN_TYPE_{date}", ["TYPE", date]),
+            fsql.SQLIndexDef("TRAN_CAT", ["CAT"]),
+        ]
+        TRAN_TABLE = fsql.SQLTableDef("TRAN", cols, indexes=indexes)
         return TRAN_TABLE
 
     def insert_data(self, id: int, date: str, type: str, value: float, cat: str, note: str):
         data = {x.name: y for x, y in zip(self._table.cols(), [id, date, type, value, cat, note])}
         with self._db as db:
-            db.insert_data(data, self._table)
+            db.insert_data(self._sql_dict(data), self._table)
             db.commit()
-        self.load_from_db()
+        self._cache_insert(pd.DataFrame([data]))
 
     def delete_data(self, id: int):
         filter = {"ID": id}
         with self._db as db:
-            db.delete_data(filter, self._table)
+            db.delete_data(self._sql_dict(filter), self._table)
             db.commit()
-        self.load_from_db()
+        self._cache_delete(filter)
 
     def query(self, date: str = "", type: str = "", cat: str = "") -> pd.DataFrame:
         filter = {}
@@ -227,22 +599,174 @@ class FinTranData(FinBaseData):
         filter = {"ID": id}
         return self._query(filter)
 
+    def summary_values(self, df: pd.DataFrame) -> pd.DataFrame:
+        # tracked money flow by type
+        return pd.DataFrame({
+            "INCOME": df["VALUE"].where(df["TYPE"] == "INCOME", 0),
+            "OUTLAY": df["VALUE"].where(df["TYPE"] == "OUTLAY", 0),
+        }, index=df.index)
+
+    @staticmethod
+    def make_ids(months, seqs) -> np.ndarray:
+        """IDs of sequences in months, both are month indexes and sequences as arrays"""
+        year, month = np.divmod(np.asarray(months, dtype="int64"), 12)
+        digit_date = year * 100 + month + 1
+        seqs = np.asarray(seqs, dtype="int64")
+        return np.where(seqs < FinTranData.ID_SEQ_SIZE, digit_date * FinTranData.ID_SEQ_SIZE + seqs, digit_date * FinTranData.WIDE_ID_SEQ_SIZE + seqs)
+
+    @staticmethod
+    def id_seqs(ids) -> np.ndarray:
+        """Sequences in the month of IDs"""
+        ids = np.asarray(ids, dtype="int64")
+        return np.where(ids < FinTranData.WIDE_ID_START, ids % FinTranData.ID_SEQ_SIZE, ids % FinTranData.WIDE_ID_SEQ_SIZE)
+
+    def _month_next_seq(self, month: int) -> int:
+        if month not in self._next_seq:
+            ids = self._query_rows({"DATE": fu.month_str(month)})["ID"]
+            self._next_seq[month] = int(self.id_seqs(ids).max()) + 1 if not ids.empty else 0
+        return self._next_seq[month]
+
     def get_unique_id(self, date: str) -> int:
-        df_date = self._df[self._df["DATE"] == date]
-        max_id_by_date = df_date["ID"].max() % 10000 + 1 if not df_date.empty else 0
-        digit_date = fu.digit_date(date)
-        return digit_date * 10000 + max_id_by_date
+        """The next ID of date, it is taken once a transaction of the ID is inserted"""
+        month = fu.month_index(date)
+        return int(self.make_ids(month, self._month_next_seq(month)))
+
+    def _reserve_seqs(self, month: int, count: int) -> int:
+        start = self._month_next_seq(month)
+        self._next_seq[month] = start + count
+        return start
+
+    def reserve_ids(self, date: str, count: int) -> np.ndarray:
+        """Take count contiguous IDs of date for a batch insert, IDs reserved but never inserted are skipped"""
+        month = fu.month_index(date)
+        start = self._reserve_seqs(month, count)
+        return self.make_ids(month, np.arange(start, start + count))
+
+    def load_from_db(self):
+        super().load_from_db()
+        self._next_seq = {}
+
+    def _cache_insert(self, df: pd.DataFrame):
+        super()._cache_insert(df)
+        if df.empty or not self._next_seq:
+            return
+        # inserted IDs take their sequences, only months already counted are followed
+        new_df = self._df.iloc[-len(df):]
+        seqs = pd.Series(self.id_seqs(new_df["ID"]) + 1, index=new_df["MONTH"].to_numpy())
+        for month, seq in seqs.groupby(level=0).max().items():
+            if month in self._next_seq:
+                self._next_seq[month] = max(self._next_seq[month], int(seq))
+
+    def _cache_delete(self, filter: dict):
+        # IDs at the end of a month are used again, so months of deleted rows are counted again
+        for month in self._query_rows(filter)["MONTH"].unique():
+            self._next_seq.pop(int(month), None)
+        super()._cache_delete(filter)
+
+    def _import_chunk(self, chunk: pd.DataFrame, first_line: int) -> pd.DataFrame:
+        """Validate and normalise a chunk of imported csv column-wise and assign IDs of reserved blocks to it"""
+        missing = [c for c in self.IMPORT_COLS if c not in chunk]
+        if missing:
+            raise ValueError(f"Missing columns: {', '.join(missing)}")
+        chunk = chunk.reset_index(drop=True)
+
+        def check(valid: pd.Series, msg: str):
+            if not valid.all():
+                lines = (np.flatnonzero(~valid.to_numpy())[:5] + first_line).tolist()
+                raise ValueError(f"{msg} at line {', '.join(map(str, lines))}")
+
+        # only distinct dates are parsed
+        codes, uniq = pd.factorize(chunk["DATE"])
+        months = np.full(len(uniq), -1, dtype="int64")
+        for i, date in enumerate(uniq):
+            try:
+                months[i] = fu.month_index(date)
+            except ValueError:
+                pass
+        months = months[codes]
+        check(pd.Series(months >= 0), "Invalid DATE")
+        check(chunk["TYPE"].isin(self.TYPES), f"TYPE is not one of {', '.join(self.TYPES)}")
+        values = pd.to_numeric(chunk["VALUE"], errors="coerce")
+        check(values.notna(), "Invalid VALUE")
+
+        month_s = pd.Series(months)
+        starts = {m: self._reserve_seqs(int(m), int(n)) for m, n in month_s.value_counts(sort=False).items()}
+        seqs = month_s.map(starts) + month_s.groupby(month_s, sort=False).cumcount()
+        return pd.DataFrame({
+            "ID": self.make_ids(months, seqs),
+            "DATE": fu.month_str_series(month_s),
+            "TYPE": chunk["TYPE"],
+            "VALUE": fu.norm_number_series(values),
+            "CAT": chunk["CAT"],
+            "NOTE": chunk["NOTE"] if "NOTE" in chunk else "",
+        })
+
+    def import_csv(self, file, chunk_size: int = fsql.FinDataSQL.CHUNK_SIZE, progress=None) -> int:
+        """
+        Append transactions of a csv file, IDs are assigned as if they were inserted one by one.
+        The file is parsed chunk by chunk, memory used besides the cached table is bounded by IMPORT_CACHE_ROWS.
+        All of the rows are written in one transaction, nothing is imported if any of them is invalid.
+
+        Args:
+            file: path or binary file object of a csv with DATE, TYPE, VALUE, CAT and optional NOTE columns,
+                an ID column is ignored
+            progress (Callable[[int, float], None]): called after each chunk with rows imported and the fraction of file read
+        Returns:
+            int: number of imported rows
+        Raises:
+            ValueError: the csv misses a column or has invalid values, lines of the first invalid rows are reported
+        """
+        rows = 0
+
+        def write(db: fsql.FinDataSQL, f):
+            nonlocal rows
+            f.seek(0, 2)
+            size = f.tell()
+            f.seek(0)
+            # chunks are appended to the cached table in blocks, appending each of them copies the table every time
+            staged = []
+            with pd.read_csv(f, chunksize=chunk_size, dtype=str, keep_default_na=False) as reader:
+                for chunk in reader:
+                    # lines are counted from 1 with the header
+                    df = self._import_chunk(chunk, rows + 2)
+                    db.insert_many(self._sql_df(df), self._table)
+                    staged.append(df)
+                    rows += len(df)
+                    if sum(len(x) for x in staged) >= self.IMPORT_CACHE_ROWS:
+                        self._cache_insert(pd.concat(staged, ignore_index=True))
+                        staged = []
+                    if progress is not None:
+                        progress(rows, f.tell() / size if size else 1.0)
+            if staged:
+                self._cache_insert(pd.concat(staged, ignore_index=True))
+
+        try:
+            with self._db as db:
+                if isinstance(file, str):
+                    with open(file, "rb") as f:
+                        db.run_in_transaction(lambda db: write(db, f))
+                else:
+                    db.run_in_transaction(lambda db: write(db, file))
+        except Exception:
+            # chunks cached before are rolled back in database
+            self.load_from_db()
+            raise
+        return rows
 
     def reindex(self):
-        df = self._df.copy()
-        self._df = pd.DataFrame(columns=self._table.cols_name())
-        for _, row in df.iterrows():
-            date = row["DATE"]
-            id = self.get_unique_id(date)
-            row["ID"] = id
-            self._df = pd.concat([self._df, row.to_frame().T], ignore_index=True)
-        print(self._df)
-        self.load_from_df(self._df)
+        """Number IDs of every month from 0 in cached order, changed IDs are rewritten in one transaction"""
+        new_ids = self.make_ids(self._df["MONTH"], self._df.groupby("MONTH", sort=False).cumcount())
+        old_ids = self._df["ID"].to_numpy()
+        changed = old_ids != new_ids
+        if not changed.any():
+            return
+
+        mapping = list(zip(old_ids[changed].tolist(), new_ids[changed].tolist()))
+        with self._db as db:
+            db.run_in_transaction(lambda db: db.remap_key("ID", mapping, self._table))
+        self._df["ID"] = new_ids
+        self._next_seq = {}
+        self._table_changed(["ID"])
 
     def get_tags(self) -> list[str]:
         df = self._df[["CAT"]]
@@ -254,21 +778,88 @@ class FinTranData(FinBaseData):
         return list(tags)
 
 
+def migrate_asset_unique(db: fsql.FinDataSQL):
+    db.ensure_unique(FinAssetData.get_table_def())
+
+
+def migrate_indexes(db: fsql.FinDataSQL):
+    db.create_indexes(FinAssetData.get_table_def())
+    db.create_indexes(FinTranData.get_table_def())
+
+
+def migrate_month_key(db: fsql.FinDataSQL):
+    """Rebuild SUBACCOUNT and TRAN of a database storing DATE as TEXT into month key mode"""
+    for table_def in [FinAssetData.get_table_def, FinTranData.get_table_def]:
+        old, new = table_def(), table_def(month_key=True)
+        tmp = fsql.SQLTableDef(f"{new.name()}_MONTH_KEY", new.cols(), new.unique())
+        db.create_table(tmp)
+        cols = [x for x in old.cols_name() if x != "DATE"]
+        db.exec(f"INSERT INTO {tmp.name()} ({', '.join(cols)}, MONTH) SELECT {', '.join(cols)}, {DATE_TO_MONTH_SQL} FROM {old.name()}")
+        db.drop_table(old)
+        db.exec(f"ALTER TABLE {tmp.name()} RENAME TO {new.name()}")
+        db.create_indexes(new)
+
+
+# Schema upgrades of existing databases, append new steps at the end with increasing versions.
+# A database created by init_db already has the latest schema.
+MIGRATIONS = [
+    fsql.SQLMigration(1, "Add unique key (DATE, ACCOUNT, SUBACCOUNT) to SUBACCOUNT", migrate_asset_unique),
+    fsql.SQLMigration(2, "Add secondary indexes to SUBACCOUNT and TRAN", migrate_indexes),
+]
+SCHEMA_VERSION = max(m.version for m in MIGRATIONS)
+
+
 class FinDataContext():
 
-    def __init__(self, db_path: str):
+    def __init__(self, db_path: str, month_key: bool = False):
+        """
+        Args:
+            month_key (bool): store DATE as an integer month index in a new database,
+                an existing database keeps its storage mode until convert_to_month_key
+        """
         self.db_path = db_path
         self.db = fsql.FinDataSQL(db_path)
-        self.asset_data = FinAssetData(self.db)
-        self.tran_data = FinTranData(self.db)
+        # the context may be shared by sessions running in different threads, see fu.synchronized
+        self.lock = threading.RLock()
+        with self.db as db:
+            stored_cols = db.query_stored_cols(FinAssetData.get_table_def().name())
+        if stored_cols:
+            month_key = "MONTH" in stored_cols
+        self.asset_data = FinAssetData(self.db, month_key=month_key)
+        self.tran_data = FinTranData(self.db, month_key=month_key)
 
         if self.validate():
-            self.asset_data.load_from_db()
-            self.tran_data.load_from_db()
+            self.upgrade_db()
 
+    @fu.synchronized
     def validate(self):
         return self.asset_data.validate() and self.tran_data.validate()
 
+    @fu.synchronized
+    def upgrade_db(self) -> None:
+        with self.db as db:
+            applied = db.migrate(MIGRATIONS)
+        for m in applied:
+            logger.info("Database upgraded to version %d: %s", m.version, m.desc)
+        if applied:
+            self.asset_data.invalidate()
+            self.tran_data.invalidate()
+
+    def month_key(self) -> bool:
+        return self.asset_data.month_key()
+
+    @fu.synchronized
+    def convert_to_month_key(self) -> None:
+        if self.month_key():
+            return
+        with self.db as db:
+            db.run_in_transaction(migrate_month_key)
+        self.asset_data.set_table(FinAssetData.get_table_def(month_key=True))
+        self.tran_data.set_table(FinTranData.get_table_def(month_key=True))
+        self.asset_data.invalidate()
+        self.tran_data.invalidate()
+
+    @fu.synchronized
     def init_db(self) -> None:
         with self.db as db:
             tables = db.get_tables()
@@ -277,86 +868,172 @@ class FinDataContext():
                 return
             db.create_table(self.asset_data._table)
             db.create_table(self.tran_data._table)
+            db.set_user_version(SCHEMA_VERSION)
             db.commit()
         self.asset_data.load_from_db()
         self.tran_data.load_from_db()
 
+    @fu.synchronized
     def clear_db(self):
         with self.db as db:
             db.clear_db()
             db.commit()
+        self.asset_data._df = None
+        self.tran_data._df = None
+        self.asset_data.summary = None
+        self.tran_data.summary = None
 
+    def close(self):
+        self.db.close()
+
+    @fu.synchronized
     def query_asset_info(self) -> pd.DataFrame:
         with self.db as db:
             return db.query_table_info(self.asset_data._table)
 
+    @fu.synchronized
     def query_tran_info(self) -> pd.DataFrame:
         with self.db as db:
             return db.query_table_info(self.tran_data._table)
 
+    def get_sql_tracer(self) -> fsql.SQLTracer:
+        return self.db.tracer
+
+    @fu.synchronized
+    def memory_usage(self) -> pd.DataFrame:
+        return pd.concat([self.asset_data.memory_usage(), self.tran_data.memory_usage()], ignore_index=True)
+
     def get_asset_cols_name(self):
-        return self.asset_data._table.cols_name()
+        return self.asset_data.cols_name()
 
+    @fu.synchronized
     def insert_asset(self, date: str, acc: str, sub: str, net: float, inflow: float, profit: float) -> None:
         self.asset_data.insert_data(date, acc, sub, net, inflow, profit)
 
+    @fu.synchronized
     def update_asset(self, date: str, acc: str, sub: str, net: float, inflow: float, profit: float) -> None:
         self.asset_data.update_data(date, acc, sub, net, inflow, profit)
 
+    @fu.synchronized
     def insert_or_update_asset(self, date: str, acc: str, sub: str, net: float, inflow: float, profit: float) -> None:
         self.asset_data.insert_or_update(date, acc, sub, net, inflow, profit)
 
+    @fu.synchronized
     def delete_asset_data(self, date: str, acc: str, sub: str) -> None:
         self.asset_data.delete_data(date, acc, sub)
 
+    @fu.synchronized
     def delete_asset(self, acc: str, sub: str) -> None:
         self.asset_data.delete_asset(acc, sub)
 
+    @fu.synchronized
     def reset_asset_table(self):
         self.asset_data.reset()
 
+    @fu.synchronized
     def reset_tran_table(self):
         self.tran_data.reset()
 
+    @fu.synchronized
     def _query_asset(self, filter: dict) -> pd.DataFrame:
         return self.asset_data._query(filter)
 
+    @fu.synchronized
     def query_asset(self, date: str = "", acc: str = "", sub: str = "") -> pd.DataFrame:
         return self.asset_data.query(date=date, acc=acc, sub=sub)
 
+    @fu.synchronized
     def query_last_asset(self, date: str, acc: str, sub: str) -> pd.DataFrame:
         return self.asset_data.query_last(date, acc, sub)
 
+    def asset_version(self) -> int:
+        return self.asset_data.version
+
+    def tran_version(self) -> int:
+        return self.tran_data.version
+
+    @fu.synchronized
+    def query_asset_snapshot(self, date: str) -> pd.DataFrame:
+        return self.asset_data.query_snapshot(date)
+
+    @fu.synchronized
+    def query_asset_panel(self, dates: list[str], assets: list[tuple[str, str]], start_date: str, end_date: str) -> pd.DataFrame:
+        return self.asset_data.query_panel(dates, assets, start_date, end_date)
+
+    @fu.synchronized
     def query_period_asset(self, start_date: str, end_date: str) -> pd.DataFrame:
         return self.asset_data.query_period(start_date, end_date)
 
+    @fu.synchronized
+    def query_monthly_summary(self, start_date: str = "", end_date: str = "") -> pd.DataFrame:
+        """
+        Monthly totals of NET_WORTH, INFLOW and PROFIT of asset records, and tracked INCOME and OUTLAY of money flow.
+        Only months having asset records are included, the same as summing asset records grouped by DATE.
+
+        Returns:
+            pd.DataFrame: columns [DATE, NET_WORTH, INFLOW, PROFIT, INCOME, OUTLAY], ordered by DATE
+        """
+        asset = self.asset_data.summary
+        tran = self.tran_data.summary.reindex(asset.index, fill_value=0)
+        df = pd.concat([asset[["NET_WORTH", "INFLOW", "PROFIT"]], tran[["INCOME", "OUTLAY"]]], axis=1)
+        if start_date or end_date:
+            df = df.loc[start_date or None:end_date or None]
+        return df.rename_axis("DATE").reset_index()
+
+    @fu.synchronized
+    def rebuild_monthly_summary(self):
+        self.asset_data.rebuild_summary()
+        self.tran_data.rebuild_summary()
+
+    @fu.synchronized
     def query_date_range(self) -> tuple[str, str]:
         return self.asset_data.query_date_range()
 
+    @fu.synchronized
     def query_asset_exist(self, date: str, acc: str, sub: str) -> bool:
         return not self.asset_data.query(date, acc, sub).empty
 
+    @fu.synchronized
     def insert_tran(self, date: str, type: str, value: float, cat: str, note: str):
         id = self.tran_data.get_unique_id(date)
         self.tran_data.insert_data(id, date, type, value, cat, note)
 
+    @fu.synchronized
     def delete_tran(self, id: int):
         self.tran_data.delete_data(id)
 
+    @fu.synchronized
     def query_tran(self, date: str = "", type: str = "", cat: str = "") -> pd.DataFrame:
         return self.tran_data.query(date, type, cat)
 
+    @fu.synchronized
     def query_period_tran(self, start_date: str, end_date: str) -> pd.DataFrame:
         return self.tran_data.query_period(start_date, end_date)
 
+    @fu.synchronized
+    def write_asset_csv(self, f):
+        self.asset_data.write_csv(f)
+
+    @fu.synchronized
+    def write_tran_csv(self, f):
+        self.tran_data.write_csv(f)
+
+    @fu.synchronized
     def df_to_asset(self, df: pd.DataFrame, append: bool = False):
         self.asset_data.load_from_df(df, append)
 
+    @fu.synchronized
     def df_to_tran(self, df: pd.DataFrame, append: bool = False):
         self.tran_data.load_from_df(df, append)
 
+    @fu.synchronized
+    def import_tran_csv(self, file, progress=None) -> int:
+        return self.tran_data.import_csv(file, progress=progress)
+
+    @fu.synchronized
     def reindex_tran_id(self):
         self.tran_data.reindex()
 
+    @fu.synchronized
     def get_tran_tags(self) -> list[str]:
         return self.tran_data.get_tags()
@@ -1,19 +1,41 @@
 import streamlit as st
-import csv
+import bisect
+import itertools
+import logging
+import os
+import random
+import re
 import sqlite3
+import threading
+import time
+import weakref
 import copy
+from collections import deque
+from datetime import datetime
 import pandas as pd
 
+logger = logging.getLogger(__name__)
+
 
 class SQLColDef:
 
-    def __init__(self, name: str = "", type: str = "", constraint: str = "", format=None):
+    def __init__(self, name: str = "", type: str = "", constraint: str = "", format=None, format_col=None, generated: str = None):
+        """
+        Args:
+            format: function to normalize a single value before it is written
+            format_col: column-wise version of format working on a whole pd.Series, used by bulk writes
+            generated (str): SQL expression of a virtual generated column, it is computed by sqlite and never written
+        """
         self.name: str = name
         self.type = type
         self.constraint = constraint
         self.format_func = format
+        self.format_col_func = format_col
+        self.generated = generated
 
     def col_def_str(self):
+        if self.generated is not None:
+            return f"{self.name} {self.type} GENERATED ALWAYS AS ({self.generated}) VIRTUAL"
         return f"{self.name} {self.type} {self.constraint}"
 
     def format(self, value, separate=False):
@@ -29,12 +51,59 @@ class SQLColDef:
             value = str(value)
         return value
 
+    def affinity(self, value):
+        """Format value and convert it like sqlite type affinity does, so cached data matches what is stored"""
+        value = self.format(value, True)
+        if value is None:
+            return value
+        if self.type == "TEXT":
+            return str(value)
+        if self.type == "REAL":
+            return float(value)
+        if self.type == "INTEGER":
+            return int(value)
+        return value
+
+    def affinity_col(self, values: pd.Series) -> pd.Series:
+        """Column-wise version of affinity"""
+        if self.format_col_func is not None:
+            values = self.format_col_func(values)
+        elif self.format_func is not None:
+            values = values.map(self.format_func)
+
+        if self.type == "TEXT":
+            return values.astype(str)
+        if self.type == "REAL":
+            return values.astype(float)
+        if self.type == "INTEGER":
+            return values.astype("int64")
+        return values
+
+
+class SQLIndexDef:
+
+    def __init__(self, name: str, cols: list[str], unique: bool = False):
+        self.name = name
+        self.cols = cols
+        self.unique = unique
+
+    def create_index_str(self, table_name: str) -> str:
+        unique_str = "UNIQUE " if self.unique else ""
+        return f"CREATE {unique_str}INDEX IF NOT EXISTS {self.name} ON {table_name} ({', '.join(self.cols)});"
+
 
 class SQLTableDef:
 
-    def __init__(self, name: str = "", cols: list[SQLColDef] = []):
+    def __init__(self, name: str = "", cols: list[SQLColDef] = [], unique: list[str] = [], indexes: list[SQLIndexDef] = []):
+        """
+        Args:
+            unique (list[str]): columns of the table's unique key, used as conflict target of upserts
+            indexes (list[SQLIndexDef]): secondary indexes created along with the table
+        """
         self._name: str = name
         self._cols = cols
+        self._unique = unique
+        self._indexes = indexes
         self._name_to_cols = {c.name: c for c in self._cols}
 
     def __getitem__(self, col_name: str) -> SQLColDef:
@@ -58,24 +127,213 @@ class SQLTableDef:
     def cols_name(self) -> list[str]:
         return [x.name for x in self.cols()]
 
+    def stored_cols(self) -> list[SQLColDef]:
+        """Columns written by inserts, generated columns are excluded"""
+        return [x for x in self._cols if x.generated is None]
+
+    def stored_cols_name(self) -> list[str]:
+        return [x.name for x in self.stored_cols()]
+
+    def unique(self) -> list[str]:
+        return copy.copy(self._unique)
+
+    def indexes(self) -> list[SQLIndexDef]:
+        return copy.copy(self._indexes)
+
     def create_table_str(self):
-        col_def = ',\n'.join([x.col_def_str() for x in self.cols()])
+        defs = [x.col_def_str() for x in self.cols()]
+        if self._unique:
+            defs.append(f"UNIQUE ({', '.join(self._unique)})")
+        col_def = ',\n'.join(defs)
         return f"CREATE TABLE {self.name()} ({col_def});"
 
+    def create_index_strs(self) -> list[str]:
+        return [x.create_index_str(self.name()) for x in self._indexes]
+
+    def format_df(self, df: pd.DataFrame) -> pd.DataFrame:
+        """Format and convert every stored column of df as it will be stored, columns are returned in table order"""
+        return pd.DataFrame({c.name: c.affinity_col(df[c.name]) for c in self.stored_cols()}, index=df.index)
+
+
+class CSVLoadError(ValueError):
+    """A chunk of a csv file failed to load in FinDataSQL.load_from_csv"""
+
+    def __init__(self, row: int, loaded: int, cause: Exception):
+        """
+        Args:
+            row (int): first data row of the failed chunk counted from 0, where a load can be resumed from
+            loaded (int): rows committed before the failed chunk
+        """
+        super().__init__(f"Failed to load rows from {row}: {cause}")
+        self.row = row
+        self.loaded = loaded
+        self.cause = cause
+
+
+class SQLMigration:
+
+    def __init__(self, version: int, desc: str, upgrade):
+        """
+        Args:
+            version (int): schema version after this migration, versions start from 1
+            upgrade (Callable[[FinDataSQL], None]): applies the migration on a borrowed FinDataSQL, it must not commit
+        """
+        self.version = version
+        self.desc = desc
+        self.upgrade = upgrade
+
+
+class SQLTracer:
+    """
+    Statement tracing of FinDataSQL, off by default. Traced statements are timed, counted in per-statement histograms,
+    kept in an in-memory ring buffer and sent to the module logger at DEBUG level.
+    """
+
+    OFF = 0
+    STATEMENT = 1
+    # bound values may contain financial data, they are only recorded on this level
+    VALUES = 2
+
+    LEVELS = {"OFF": OFF, "STATEMENT": STATEMENT, "VALUES": VALUES}
+    HISTOGRAM_BOUNDS_MS = [0.1, 0.5, 1, 5, 10, 50, 100, 500, 1000]
+
+    def __init__(self, level: int = OFF, sample_rate: float = 1.0, buffer_size: int = 200):
+        """
+        Args:
+            level (int): one of OFF, STATEMENT and VALUES
+            sample_rate (float): fraction of statements traced when level is not OFF
+            buffer_size (int): number of latest traced statements kept in the ring buffer
+        """
+        self.level = level
+        self.sample_rate = sample_rate
+        self.records: deque[dict] = deque(maxlen=buffer_size)
+        self.histograms: dict[str, list[int]] = {}
+        self._lock = threading.Lock()
+
+    def sample(self) -> bool:
+        if self.level == SQLTracer.OFF:
+            return False
+        return self.sample_rate >= 1 or random.random() < self.sample_rate
+
+    def statement_key(exec_str: str) -> str:
+        # statements built with inlined literals are counted together with their placeholder form
+        key = re.sub(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b", "?", exec_str)
+        return " ".join(key.split())
+
+    def record(self, exec_str: str, values, elapsed: float, rows: int = 1):
+        elapsed_ms = elapsed * 1000
+        key = SQLTracer.statement_key(exec_str)
+        record = {"TIME": datetime.now().strftime("%H:%M:%S.%f")[:-3], "STATEMENT": key, "ROWS": rows, "ELAPSED_MS": round(elapsed_ms, 3)}
+        if self.level >= SQLTracer.VALUES and values is not None:
+            record["VALUES"] = repr(values[:5] if rows > 1 else values)
+        bucket = bisect.bisect_left(SQLTracer.HISTOGRAM_BOUNDS_MS, elapsed_ms)
+        with self._lock:
+            self.records.append(record)
+            hist = self.histograms.setdefault(key, [0] * (len(SQLTracer.HISTOGRAM_BOUNDS_MS) + 1))
+            hist[bucket] += 1
+        logger.debug("%.3f ms, %d rows: %s", elapsed_ms, rows, key, extra={"sql": record})
+
+    def records_df(self) -> pd.DataFrame:
+        with self._lock:
+            records = list(self.records)
+        return pd.DataFrame(records, columns=["TIME", "STATEMENT", "ROWS", "ELAPSED_MS", "VALUES"])
+
+    def histogram_df(self) -> pd.DataFrame:
+        bounds = SQLTracer.HISTOGRAM_BOUNDS_MS
+        cols = [f"<={b}ms" for b in bounds] + [f">{bounds[-1]}ms"]
+        with self._lock:
+            data = {k: list(v) for k, v in self.histograms.items()}
+        df = pd.DataFrame.from_dict(data, orient="index", columns=cols)
+        df.insert(0, "COUNT", df.sum(axis=1))
+        return df.sort_values("COUNT", ascending=False)
+
+    def clear(self):
+        with self._lock:
+            self.records.clear()
+            self.histograms.clear()
+
 
 class FinDataSQL:
 
-    def __init__(self, db_path: str):
+    CHUNK_SIZE = 1000
+
+    DEFAULT_PRAGMAS = {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "cache_size": -16000,
+        "mmap_size": 64 * 1024 * 1024,
+    }
+
+    def __init__(self, db_path: str, pool_size: int = 4, pragmas: dict = None, tracer: SQLTracer = None):
+        """
+        Args:
+            db_path (str): path of the sqlite database
+            pool_size (int): max number of idle connections kept open between `with` blocks, 0 closes every connection on exit
+            pragmas (dict): PRAGMAs applied on every new connection, merged over DEFAULT_PRAGMAS, a None value skips the PRAGMA
+            tracer (SQLTracer): statement tracer, a disabled one is created if not given
+        """
         self.db_path = db_path
-        self.db: sqlite3.Connection = None
+        self.tracer = tracer if tracer is not None else SQLTracer()
+        self.pool_size = pool_size
+        self.pragmas = {**FinDataSQL.DEFAULT_PRAGMAS, **(pragmas or {})}
+        self._idle: list[sqlite3.Connection] = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        weakref.finalize(self, FinDataSQL._close_connections, self._idle, self._lock)
+
+    @property
+    def db(self) -> sqlite3.Connection:
+        """The connection borrowed by current thread, None outside of a `with` block"""
+        return getattr(self._local, "conn", None)
+
+    def connect(self) -> sqlite3.Connection:
+        # connections move between threads through the pool, but only one thread holds a connection at a time
+        conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        for k, v in self.pragmas.items():
+            if v is not None:
+                conn.execute(f"PRAGMA {k}={v}")
+        return conn
+
+    def _acquire(self) -> sqlite3.Connection:
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+        return self.connect()
+
+    def _release(self, conn: sqlite3.Connection):
+        # drop uncommitted changes, the same as closing the connection does
+        if conn.in_transaction:
+            conn.rollback()
+        with self._lock:
+            if len(self._idle) < self.pool_size:
+                self._idle.append(conn)
+                return
+        conn.close()
 
     def __enter__(self):
-        print(self.db_path)
-        self.db = sqlite3.connect(self.db_path)
+        depth = getattr(self._local, "depth", 0)
+        if depth == 0:
+            self._local.conn = self._acquire()
+        self._local.depth = depth + 1
         return self
 
     def __exit__(self, exc_type, exc_value, exc_traceback):
-        self.db.close()
+        self._local.depth -= 1
+        if self._local.depth == 0:
+            conn = self._local.conn
+            self._local.conn = None
+            self._release(conn)
+
+    def _close_connections(idle: list[sqlite3.Connection], lock: threading.Lock):
+        with lock:
+            conns = list(idle)
+            idle.clear()
+        for conn in conns:
+            conn.close()
+
+    def close(self):
+        """Shutdown hook, close all idle connections. Later `with` blocks open new connections on demand"""
+        FinDataSQL._close_connections(self._idle, self._lock)
 
     def get_tables(self) -> list[str]:
         """
@@ -84,14 +342,24 @@ class FinDataSQL:
         """
         return self.exec("SELECT name FROM sqlite_master WHERE type='table';").fetchall()
 
+    def _execute(self, func, exec_str, values=None, rows: int = 1) -> sqlite3.Cursor:
+        args = (exec_str,) if values is None else (exec_str, values)
+        if not self.tracer.sample():
+            return func(*args)
+        # time of executing the statement, rows fetched from the cursor later are not counted
+        start = time.perf_counter()
+        cursor = func(*args)
+        self.tracer.record(exec_str, values, time.perf_counter() - start, rows)
+        return cursor
+
     def exec(self, exec_str):
-        print(exec_str)
-        return self.db.execute(exec_str)
+        return self._execute(self.db.execute, exec_str)
 
     def exec_value(self, exec_str, values):
-        print(exec_str)
-        print(', '.join([str(x) for x in values]))
-        return self.db.execute(exec_str, values)
+        return self._execute(self.db.execute, exec_str, values)
+
+    def exec_many(self, exec_str, values_list: list):
+        return self._execute(self.db.executemany, exec_str, values_list, len(values_list))
 
     def clear_db(self):
         tables = self.get_tables()
@@ -103,6 +371,50 @@ class FinDataSQL:
 
     def create_table(self, table: SQLTableDef):
         self.exec(table.create_table_str())
+        self.create_indexes(table)
+
+    def create_indexes(self, table: SQLTableDef):
+        for index_str in table.create_index_strs():
+            self.exec(index_str)
+
+    def user_version(self) -> int:
+        return self.exec("PRAGMA user_version").fetchone()[0]
+
+    def set_user_version(self, version: int):
+        self.exec(f"PRAGMA user_version = {int(version)}")
+
+    def run_in_transaction(self, func):
+        """
+        Run func on this FinDataSQL in an explicit transaction, so schema changes are atomic as well.
+        It is committed if func returns and rolled back if func raises, func must not commit.
+        """
+        self.exec("BEGIN")
+        try:
+            func(self)
+            self.commit()
+        except Exception:
+            self.db.rollback()
+            raise
+
+    def migrate(self, migrations: list[SQLMigration]) -> list[SQLMigration]:
+        """
+        Run migrations newer than the database's user_version in version order, each one in its own transaction
+
+        Returns:
+            list[SQLMigration]: migrations applied
+        """
+        applied = []
+        for m in sorted(migrations, key=lambda x: x.version):
+            if m.version <= self.user_version():
+                continue
+
+            def upgrade(db: FinDataSQL, m=m):
+                m.upgrade(db)
+                db.set_user_version(m.version)
+
+            self.run_in_transaction(upgrade)
+            applied.append(m)
+        return applied
 
     def empty(self, table: SQLTableDef):
         return self.exec(f"SELECT COUNT(*) FROM {table.name()}").fetchone()[0] == 0
@@ -111,10 +423,19 @@ class FinDataSQL:
         results = self.exec(f"SELECT * FROM {table.name()}").fetchall()
         return results
 
+    def iter_rows(self, cols: list[str], table: SQLTableDef, chunk_size: int = CHUNK_SIZE):
+        """
+        Returns:
+            Iterator[list[tuple]]: rows of cols in lists of at most chunk_size rows, fetched from one cursor as it is iterated
+        """
+        cursor = self.exec(f"SELECT {', '.join(cols)} FROM {table.name()}")
+        while rows := cursor.fetchmany(chunk_size):
+            yield rows
+
     def insert_data(self, data: dict, table: SQLTableDef):
         insert_keys = []
         insert_values = []
-        for c in table.cols():
+        for c in table.stored_cols():
             k = c.name
             assert k in data, f"{k} is not in {data}"
             insert_keys.append(k)
@@ -126,6 +447,108 @@ class FinDataSQL:
         execute_str = f"INSERT INTO {table.name()} ({key_str}) VALUES ({value_str});"
         self.exec(execute_str)
 
+    def iter_chunks(rows, cols: list[str], chunk_size: int):
+        """
+        Args:
+            rows (pd.DataFrame | Iterable[dict | Sequence]): rows keyed by column name, or in column order
+        Returns:
+            Iterator[pd.DataFrame]: DataFrames of at most chunk_size rows with columns cols
+        """
+        if isinstance(rows, pd.DataFrame):
+            rows = rows[cols]
+            for i in range(0, len(rows), chunk_size):
+                yield rows.iloc[i:i + chunk_size]
+            return
+
+        it = iter(rows)
+        while chunk := list(itertools.islice(it, chunk_size)):
+            if isinstance(chunk[0], dict):
+                yield pd.DataFrame.from_records(chunk, columns=cols)
+            else:
+                yield pd.DataFrame([list(x) for x in chunk], columns=cols)
+
+    def _write_many(self, cmd_str: str, rows, table: SQLTableDef, chunk_size: int) -> int:
+        count = 0
+        for chunk in FinDataSQL.iter_chunks(rows, table.stored_cols_name(), chunk_size):
+            values = table.format_df(chunk).to_numpy(dtype=object).tolist()
+            self.exec_many(cmd_str, values)
+            count += len(values)
+        return count
+
+    def insert_many(self, rows, table: SQLTableDef, chunk_size: int = CHUNK_SIZE) -> int:
+        """
+        Insert rows with executemany in current transaction, values are formatted column-wise per chunk. Caller commits.
+
+        Args:
+            rows (pd.DataFrame | Iterable[dict | Sequence]): rows keyed by column name, or in table column order,
+                of the stored columns only
+            chunk_size (int): number of rows bound per executemany
+        Returns:
+            int: number of inserted rows
+        """
+        return self._write_many(FinDataSQL.insert_cmd(table), rows, table, chunk_size)
+
+    def insert_cmd(table: SQLTableDef) -> str:
+        cols = table.stored_cols_name()
+        marks = ', '.join(['?'] * len(cols))
+        return f"INSERT INTO {table.name()} ({', '.join(cols)}) VALUES ({marks})"
+
+    def upsert_many(self, rows, table: SQLTableDef, chunk_size: int = CHUNK_SIZE) -> int:
+        """
+        Same as insert_many, but a row whose unique key already exists updates the existing row instead
+        """
+        keys = table.unique()
+        assert keys, f"{table.name()} doesn't have a unique key"
+        cols = table.stored_cols_name()
+        marks = ', '.join(['?'] * len(cols))
+        set_str = ', '.join([f"{c} = excluded.{c}" for c in cols if c not in keys])
+        cmd_str = f"INSERT INTO {table.name()} ({', '.join(cols)}) VALUES ({marks}) ON CONFLICT ({', '.join(keys)}) DO UPDATE SET {set_str}"
+        return self._write_many(cmd_str, rows, table, chunk_size)
+
+    def remap_key(self, col: str, mapping: list[tuple[int, int]], table: SQLTableDef) -> None:
+        """
+        Change values of a unique non-negative integer col from old to new of mapping pairs with two UPDATEs.
+        Remapped rows are moved above every old and new value first, so col stays unique after each statement.
+        It must be run in a transaction, see run_in_transaction.
+        """
+        if not mapping:
+            return
+        name = table.name()
+        tmp = f"{name}_{col}_MAP"
+        offset = max(self.query_max(col, table) or 0, max(new for _, new in mapping)) + 1
+        self.exec(f"CREATE TEMP TABLE {tmp} (OLD INTEGER PRIMARY KEY, NEW INTEGER NOT NULL)")
+        self.exec_many(f"INSERT INTO {tmp} VALUES (?, ?)", mapping)
+        self.exec_value(f"UPDATE {name} SET {col} = (SELECT NEW FROM {tmp} WHERE OLD = {name}.{col}) + ? "
+                        f"WHERE {col} IN (SELECT OLD FROM {tmp})", (offset,))
+        self.exec_value(f"UPDATE {name} SET {col} = {col} - ? WHERE {col} >= ?", (offset, offset))
+        self.exec(f"DROP TABLE {tmp}")
+
+    def ensure_unique(self, table: SQLTableDef) -> bool:
+        """
+        Add the unique key to a table created without it, duplicated rows are removed and the last inserted one is kept
+
+        Returns:
+            bool: True if table is changed
+        """
+        keys = table.unique()
+        if not keys:
+            return False
+        for index in self.exec(f"PRAGMA index_list({table.name()})").fetchall():
+            name, unique = index[1], index[2]
+            cols = [x[2] for x in self.exec(f"PRAGMA index_info({name})").fetchall()]
+            if unique and set(cols) == set(keys):
+                return False
+
+        keys_str = ', '.join(keys)
+        duplicated = self.exec(f"SELECT {keys_str}, COUNT(*) - 1 FROM {table.name()} GROUP BY {keys_str} HAVING COUNT(*) > 1").fetchall()
+        if duplicated:
+            # rows of the user are removed, never do it silently
+            logger.warning("Removing %d duplicated rows of %s, kept the last inserted row of keys (%s): %s",
+                           sum(x[-1] for x in duplicated), table.name(), keys_str, [x[:-1] for x in duplicated])
+        self.exec(f"DELETE FROM {table.name()} WHERE rowid NOT IN (SELECT MAX(rowid) FROM {table.name()} GROUP BY {keys_str})")
+        self.exec(f"CREATE UNIQUE INDEX {table.name()}_UNIQUE ON {table.name()} ({keys_str})")
+        return True
+
     def sql_placeholder_and_values(filter: dict, table: SQLTableDef, delimiter: str = "AND") -> tuple[str, list]:
         cmd_placeholder = ""
         values = []
@@ -141,9 +564,9 @@ class FinDataSQL:
             i = i + 1
         return cmd_placeholder, values
 
-    def sql_cmd_between_period(col: SQLColDef, start: str, end: str):
-        date_str = f'''{col.name} BETWEEN "{start}" AND "{end}"'''
-        return date_str
+    def sql_cmd_between_period(col: SQLColDef, start: str, end: str) -> tuple[str, list]:
+        date_str = f'''{col.name} BETWEEN ? AND ?'''
+        return date_str, [start, end]
 
     def sql_cmd_filter_cols_with_placeholder(cols, len_of_values):
         cols_str = ', '.join(cols)
@@ -160,7 +583,9 @@ class FinDataSQL:
         self.exec_value(cmd_str, values)
 
     def insert_or_update(self, filter: dict, data: dict, table: SQLTableDef):
-        if self.query_exist(filter, table):
+        if table.unique() and set(filter) == set(table.unique()):
+            self.upsert_many([{**filter, **data}], table)
+        elif self.query_exist(filter, table):
             self.update_data(filter, data, table)
         else:
             d = {**filter, **data}
@@ -183,10 +608,14 @@ class FinDataSQL:
         self.db.commit()
 
     def query_period(self, period_filter: dict[str, tuple[any, any]], filter: dict, table: SQLTableDef):
-        period_cmds = [FinDataSQL.sql_cmd_between_period(table[col], start, end) for col, (start, end) in period_filter.items()]
+        period_cmds = []
+        values = []
+        for col, (start, end) in period_filter.items():
+            cmd, period_values = FinDataSQL.sql_cmd_between_period(table[col], start, end)
+            period_cmds.append(cmd)
+            values += period_values
         period_cmd = " AND ".join(period_cmds)
 
-        values = []
         if filter:
             where_ph, where_values = FinDataSQL.sql_placeholder_and_values(filter, table, "AND")
             cmd_str = f'''SELECT * FROM {table.name()} WHERE {period_cmd} AND {where_ph}'''
@@ -202,18 +631,70 @@ class FinDataSQL:
         self.exec_value(cmd_str, where_values)
 
     def query_table_info(self, table: SQLTableDef):
-        return self.exec(f'''PRAGMA table_info({table.name()})''').fetchall()
+        # table_xinfo also lists generated columns
+        return self.exec(f'''PRAGMA table_xinfo({table.name()})''').fetchall()
 
-    def load_from_csv(self, csv_path, table: SQLTableDef):
-        with open(csv_path, 'r') as f:
-            reader = csv.reader(f)
-            csv_data = list(reader)
-        assert (len(csv_data[0]) == len(table.cols_name()))
+    def query_stored_cols(self, table_name: str) -> list[str]:
+        """Names of the stored columns of a table in database, which may differ from its current SQLTableDef"""
+        return [x[1] for x in self.exec(f"PRAGMA table_info({table_name})").fetchall()]
 
-        for data in csv_data[1:]:
-            insert_data = {x: y for x, y in zip(table.cols_name(), data)}
-            self.insert_data(insert_data, table)
-        self.db.commit()
+    def load_from_csv(self, csv_path, table: SQLTableDef, chunk_size: int = CHUNK_SIZE, progress=None,
+                      on_error: str = "rollback", start_row: int = 0) -> tuple[int, list[tuple[int, str]]]:
+        """
+        Load a csv file of the stored columns in table order with a header line. The file is read in chunks of chunk_size rows,
+        converted column-wise and inserted with executemany, each chunk in its own savepoint, so memory doesn't grow with the file.
+
+        Args:
+            progress (Callable[[int, int, int], None]): called after each chunk with rows read, bytes read and bytes of the file
+            on_error (str): what a failed chunk does,
+                "rollback" undoes the whole load and raises CSVLoadError,
+                "skip" undoes the chunk only and goes on, the chunk is reported,
+                "stop" commits the chunks before it and raises CSVLoadError, the load can be resumed from its row
+            start_row (int): data rows to skip, to resume a stopped load
+        Returns:
+            tuple[int, list[tuple[int, str]]]: rows loaded, and first row and error of every skipped chunk
+        """
+        assert on_error in ("rollback", "skip", "stop"), f"Unknown on_error {on_error}"
+        cols = table.stored_cols_name()
+        cmd_str = FinDataSQL.insert_cmd(table)
+        size = os.path.getsize(csv_path)
+        loaded = 0
+        skipped = []
+        stopped = None
+
+        def load(db: FinDataSQL):
+            nonlocal loaded, stopped
+            with open(csv_path, "rb") as f:
+                header = pd.read_csv(f, nrows=0).columns
+                assert len(header) == len(cols), f"Columns of csv {list(header)} don't match {cols}"
+                f.seek(0)
+                row = start_row
+                with pd.read_csv(f, chunksize=chunk_size, dtype=str, keep_default_na=False, header=0, names=cols,
+                                 skiprows=range(1, start_row + 1)) as reader:
+                    for chunk in reader:
+                        db.exec("SAVEPOINT load_csv_chunk")
+                        try:
+                            db._write_many(cmd_str, chunk, table, chunk_size)
+                        except (ValueError, TypeError, sqlite3.Error) as e:
+                            db.exec("ROLLBACK TO load_csv_chunk")
+                            db.exec("RELEASE load_csv_chunk")
+                            if on_error == "rollback":
+                                raise CSVLoadError(row, 0, e) from e
+                            if on_error == "stop":
+                                stopped = CSVLoadError(row, loaded, e)
+                                return
+                            skipped.append((row, str(e)))
+                        else:
+                            db.exec("RELEASE load_csv_chunk")
+                            loaded += len(chunk)
+                        row += len(chunk)
+                        if progress is not None:
+                            progress(row, f.tell(), size)
+
+        self.run_in_transaction(load)
+        if stopped is not None:
+            raise stopped
+        return loaded, skipped
 
     def query_max(self, col, table: SQLTableDef):
         return self.exec(f'''SELECT MAX({col}) FROM {table.name()}''').fetchone()[0]
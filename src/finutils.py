@@ -1,5 +1,7 @@
 from datetime import datetime
 from typing import Sequence
+import functools
+import numpy as np
 import pandas as pd
 import re
 
@@ -22,41 +24,84 @@ def cur_month() -> int:
     return month
 
 
-def norm_date(date: str) -> str:
+# Dates are "YYYY-MM" months. Internally a month is an integer month index, year * 12 + month - 1,
+# so month arithmetic doesn't construct a pd.Period. Parsing is memoized, dates repeat a lot.
+DATE_CACHE_SIZE = 4096
+
+
+@functools.lru_cache(maxsize=DATE_CACHE_SIZE)
+def month_index(date: str) -> int:
     p = pd.Period(date, freq='M')
-    return p.strftime("%Y-%m")
+    return p.year * 12 + p.month - 1
+
+
+def month_str(index: int) -> str:
+    year, month = divmod(index, 12)
+    return f"{year:04d}-{month + 1:02d}"
+
+
+@functools.lru_cache(maxsize=DATE_CACHE_SIZE)
+def norm_date(date: str) -> str:
+    return month_str(month_index(date))
+
+
+def month_index_series(dates: pd.Series) -> pd.Series:
+    # only distinct dates are parsed, a ledger has far less months than rows
+    codes, uniq = pd.factorize(dates)
+    if (codes < 0).any():
+        raise ValueError(f"Missing date at row {dates.index[codes < 0][0]}")
+    index = np.array([month_index(x) for x in uniq], dtype=np.int64)
+    return pd.Series(index[codes], index=dates.index)
+
+
+def month_str_series(index: pd.Series) -> pd.Series:
+    codes, uniq = pd.factorize(index)
+    strs = np.array([month_str(int(x)) for x in uniq], dtype=object)
+    return pd.Series(strs[codes], index=index.index)
+
 
+def norm_date_series(dates: pd.Series) -> pd.Series:
+    return month_str_series(month_index_series(dates))
 
+
+def digit_date_series(dates: pd.Series) -> pd.Series:
+    year, month = np.divmod(month_index_series(dates), 12)
+    return year * 100 + month + 1
+
+
+@functools.lru_cache(maxsize=DATE_CACHE_SIZE)
 def digit_date(date: str) -> int:
-    p = pd.Period(date, freq='M')
-    return int(p.strftime("%Y%m"))
+    year, month = divmod(month_index(date), 12)
+    return year * 100 + month + 1
 
 
+@functools.lru_cache(maxsize=DATE_CACHE_SIZE)
 def prev_date(date: str) -> str:
-    p = pd.Period(date, freq='M')
-    p = p - 1
-    return p.strftime("%Y-%m")
+    return month_str(month_index(date) - 1)
 
 
+@functools.lru_cache(maxsize=DATE_CACHE_SIZE)
 def next_date(date: str) -> str:
-    p = pd.Period(date, freq='M')
-    p = p + 1
-    return p.strftime("%Y-%m")
+    return month_str(month_index(date) + 1)
 
 
 def get_date(year: int, month: int) -> str:
-    return pd.Period(year=year, month=month, freq="M").strftime("%Y-%m")
+    if not 1 <= month <= 12:
+        raise ValueError(f"Invalid month {month}")
+    return month_str(year * 12 + month - 1)
+
+
+@functools.lru_cache(maxsize=DATE_CACHE_SIZE)
+def _date_range(start_date: str, end_date: str) -> tuple[str]:
+    return tuple(month_str(i) for i in range(month_index(start_date), month_index(end_date) + 1))
 
 
 def date_list(start_date: str, end_date: str) -> list[str]:
-    period_range = pd.period_range(start=start_date, end=end_date, freq='M')
-    return [p.strftime("%Y-%m") for p in period_range]
+    return list(_date_range(start_date, end_date))
 
 
 def year_list(start_date: str, end_date: str) -> list[int]:
-    period_range = pd.period_range(start=start_date, end=end_date, freq='Y')
-    year_list = [int(p.strftime("%Y")) for p in period_range]
-    return year_list
+    return list(range(month_index(start_date) // 12, month_index(end_date) // 12 + 1))
 
 
 def round_df(df: pd.DataFrame, cols: Sequence[str]) -> pd.DataFrame:
@@ -75,6 +120,12 @@ def norm_number(v, digits: int = 2):
     return round(v, digits)
 
 
+def norm_number_series(values: pd.Series, digits: int = 2) -> pd.Series:
+    # Series.round doesn't round halfway values like round, which norm_number uses, by the exact binary value
+    values = pd.to_numeric(values)
+    return pd.Series([round(v, digits) for v in values.tolist()], index=values.index, dtype=np.float64, name=values.name)
+
+
 def month_list() -> list[str]:
     return ["Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"]
 
@@ -91,3 +142,16 @@ def gen_txt_with_color_and_arrow(num):
         return f":red[▲ {num}]"
     else:
         return f":green[▼ {num}]"
+
+
+def synchronized(func):
+    """
+    Run a method holding the lock of its object, a FinDataContext or a FinConfig sharing its lock.
+    Reads and writes of the cached tables are serialized, they work in memory and are short,
+    so a reader never sees a table in the middle of a write.
+    """
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        with self.lock:
+            return func(self, *args, **kwargs)
+    return wrapper
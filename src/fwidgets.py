@@ -17,6 +17,9 @@ from src.st_utils import FinLogger
 def check_context():
     if "context" not in st.session_state:
         st.switch_page("Home.py")
+    context: FinContext = st.session_state['context']
+    # the config file may be edited outside of this session
+    context.config.reload_if_changed()
 
 
 def check_account():
@@ -88,10 +91,10 @@ def delete_account():
 
 def editable_accounts(df=None, key=0, container_width=False):
     context: FinContext = st.session_state['context']
-    col_config = {k: st.column_config.SelectboxColumn(k, options=v) for k, v in context.cat_dict.items()}
+    col_config = {k: st.column_config.SelectboxColumn(k, options=v) for k, v in context.config.cat_dict.items()}
     if df is None:
-        df = context.account_df()
-    col_config.update({col: st.column_config.TextColumn(col, disabled=True) for col in df.columns if col not in context.cat_dict})
+        df = context.config.account_df()
+    col_config.update({col: st.column_config.TextColumn(col, disabled=True) for col in df.columns if col not in context.config.cat_dict})
     return st.data_editor(df, hide_index=True, column_config=col_config, key=key, use_container_width=container_width)
 
 
@@ -154,44 +157,66 @@ def load_from_csv_dia():
             st.error(err_msg)
             st.stop()
 
+        report = context.reconcile_assets(data_df)
+        missing = int((~report["EXISTS"]).sum())
+        st.write(f"{len(data_df):,} rows of {len(report):,} assets, {missing:,} of them are not in your accounts")
+
         acc_df = None
         add_missing_acc = st.toggle("Add missing account/asset", value=True, key="load_csv_dia_toggle")
 
         if add_missing_acc:
-            new_ass: set[tuple] = set()
-            for index, row in data_df.iterrows():
-                acc_name = row["ACCOUNT"]
-                sub_name = row["SUBACCOUNT"]
-                if not context.has_asset(acc_name, sub_name):
-                    new_ass.add((acc_name, sub_name))
-
-            acc_data = []
-            for i in new_ass:
-                d = list(i)
-                d.extend([None] * len(context.config.cat_dict))
-                acc_data.append(d)
-
-            cols = ["ACCOUNT", "SUBACCOUNT"]
-            cols.extend([k for k in context.config.cat_dict])
-
-            if acc_data:
-                acc_df = pd.DataFrame(columns=cols, data=acc_data)
+            if missing:
+                acc_df = context.missing_account_df(report)
                 acc_df = editable_accounts(acc_df, key="load_csv_acc_edit_df", container_width=True)
             else:
                 st.info("You don't have any missing account in uploaded csv")
 
         if st.button("Submit", key="load_csv_submit", type="primary"):
-            context.df_to_asset(acc_df)
+            # rows of existing dates and assets are updated, others are added
             context.config.add_account_from_df(acc_df)
+            context.df_to_asset(data_df, append=True)
             st.rerun()
 
         st.write("Your uploaded file:")
-        st.table(data_df)
+        paginated_table(data_df, key="load_csv_preview")
 
     else:
         st.warning("You need to upload a csv file")
 
 
+def paginated_table(df: pd.DataFrame, key: str, page_size: int = 20, container=st):
+    """Show one page of df at a time, only rows of the page are sent to the browser"""
+    pages = max((len(df) - 1) // page_size + 1, 1)
+    page = 1
+    if pages > 1:
+        page = container.number_input(f"Page of {pages:,}", min_value=1, max_value=pages, value=1, step=1, key=f"{key}_page")
+    start = (page - 1) * page_size
+    container.dataframe(df.iloc[start:start + page_size], use_container_width=True)
+
+
+@st.dialog("Load money flow from csv file")
+def load_tran_from_csv_dia():
+    context: FinContext = st.session_state['context']
+    st.info("Transactions of the file are appended with new IDs, required columns: [DATE, TYPE, VALUE, CAT], NOTE is optional")
+    upload_file = st.file_uploader("Choose a csv file", key="load_tran_csv_uploader")
+    if upload_file is not None:
+        if st.button("Submit", key="load_tran_csv_submit", type="primary", use_container_width=True):
+            bar = st.progress(0.0, text="Importing")
+
+            def progress(rows: int, fraction: float):
+                bar.progress(min(fraction, 1.0), text=f"Imported {rows:,} rows")
+
+            try:
+                rows = context.import_tran_csv(upload_file, progress)
+            except ValueError as e:
+                st.error(f"Nothing is imported: {e}")
+                st.stop()
+            st.toast(f"Imported {rows:,} rows")
+            st.rerun()
+    else:
+        st.button("Submit", key="load_tran_csv_submit_disable", type="secondary", use_container_width=True, disabled=True)
+
+
 @st.dialog("Load zipped data")
 def load_from_zipped_dia():
     st.warning("Load from zipped data will clear up all of yours data!")
@@ -204,10 +229,12 @@ def load_from_zipped_dia():
             for f in file_list:
                 FinLogger.expect_and_stop(f in files, f"Doesn't find {f} in uploaded zip")
         if st.button("Submit", key="load_zipped_file_submit", type="primary", use_container_width=True):
-            context.config.clear_config()
-            context.config.write_config()
-            context.init_db()
-            context.load_from_zip_data(upload_file)
+            # the config file is written once with the loaded config
+            with context.config.batch():
+                context.config.clear_config()
+                context.config.write_config()
+                context.init_db()
+                context.load_from_zip_data(upload_file)
             st.rerun()
     else:
         st.button("Submit", key="load_zipped_file_submit_disable", type="secondary", use_container_width=True, disabled=True)
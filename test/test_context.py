@@ -0,0 +1,67 @@
+import unittest
+import io
+import os
+import shutil
+import tempfile
+import zipfile
+from src.context import FinContext
+
+
+class TestFinContext(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.context = FinContext(os.path.join(self.temp_dir, "config.json"), os.path.join(self.temp_dir, "test_database.db"))
+        self.context.init_db()
+        self.context.config.add_asset("Bank", "Saving", {})
+        self.context.config.add_asset("Bank", "Fund", {})
+
+    def tearDown(self):
+        self.context.close()
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def test_cached_snapshot(self):
+        self.context.insert_asset("2024-01", "Bank", "Saving", 100, 10, 1)
+        self.context.insert_asset("2024-02", "Bank", "Fund", 50, 5, 2)
+        self.assertEqual(self.context.query_total_worth("2024-02"), 150)
+        self.assertEqual(self.context.query_date("2024-02")["SUBACCOUNT"].tolist(), ["Saving", "Fund"])
+
+        # a write of asset data or a change of config drops the cached snapshots and totals
+        self.context.insert_asset("2024-02", "Bank", "Saving", 120, 10, 20)
+        self.assertEqual(self.context.query_total_worth("2024-02"), 170)
+        self.assertEqual(self.context.query_total_profit("2024-02"), 22)
+        self.context.config.delete_asset("Bank", "Fund")
+        self.assertEqual(self.context.query_date("2024-02")["SUBACCOUNT"].tolist(), ["Saving"])
+        self.assertEqual(self.context.query_total_worth("2024-02"), 120)
+
+    def test_export(self):
+        self.context.insert_asset("2024-01", "Bank", "Saving", 100.5, 10, 1)
+        self.context.insert_asset("2024-02", "Bank", "Fund", 50, 5.25, 0)
+        self.context.insert_tran("2024-01", "INCOME", 1000, "salary", "")
+        self.context.insert_tran("2024-02", "OUTLAY", 200.1, "food", "lunch")
+
+        for month_key in [False, True]:
+            if month_key:
+                self.context.convert_to_month_key()
+            with self.subTest(month_key=month_key):
+                # rows streamed from database are written the same as the csv of the queried tables
+                asset_csv = self.context.query_asset().to_csv(index=False).encode("utf-8")
+                tran_csv = self.context.query_tran().to_csv(index=False).encode("utf-8")
+                self.assertEqual(self.context.get_asset_data(), asset_csv)
+                self.assertEqual(self.context.get_tran_data(), tran_csv)
+                with zipfile.ZipFile(io.BytesIO(self.context.get_zip_data())) as z:
+                    self.assertEqual(z.read("asset.txt"), asset_csv)
+                    self.assertEqual(z.read("flow.txt"), tran_csv)
+                    self.assertEqual(z.read("config.json").decode(), self.context.config.to_json())
+
+        # an export is made again after a write
+        self.assertTrue(self.context.export_ready("zip"))
+        self.context.insert_tran("2024-02", "OUTLAY", 10, "food", "")
+        self.assertFalse(self.context.export_ready("zip"))
+        self.assertFalse(self.context.export_ready("tran"))
+        self.assertIn(b"10.0,food", self.context.get_tran_data())
+        self.assertTrue(self.context.export_ready("tran"))
+
+
+if __name__ == '__main__':
+    unittest.main()
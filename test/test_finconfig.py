@@ -0,0 +1,137 @@
+import unittest
+import os
+import json
+import shutil
+import tempfile
+import threading
+import pandas as pd
+from src.finconfig import FinConfig
+
+
+class TestFinConfig(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.config_path = os.path.join(self.temp_dir, "config.json")
+        self.config = FinConfig(self.config_path)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def read_file(self) -> dict:
+        with open(self.config_path) as f:
+            return json.load(f)
+
+    def test_write_config(self):
+        self.config.add_asset("Bank", "Saving", {})
+        self.assertEqual(self.read_file()["Assets"], [{"Name": "Saving", "Account": "Bank", "Category": {}}])
+        # unchanged content is not written again
+        self.assertFalse(self.config.write_config())
+        self.assertEqual(os.listdir(self.temp_dir), ["config.json"])
+
+    def test_batch(self):
+        with self.config.batch():
+            self.config.add_asset("Bank", "Saving", {})
+            with self.config.batch():
+                self.config.add_asset("Bank", "Fund", {})
+            self.assertNotIn("Assets", self.read_file())
+        self.assertEqual(len(self.read_file()["Assets"]), 2)
+
+        # a failed batch is not written and its mutations are dropped
+        with self.assertRaises(RuntimeError):
+            with self.config.batch():
+                self.config.delete_asset("Bank", "Saving")
+                raise RuntimeError()
+        self.assertEqual(self.config.asset_keys(), [("Bank", "Saving"), ("Bank", "Fund")])
+        self.assertEqual(len(self.read_file()["Assets"]), 2)
+
+    def test_batch_base_exception(self):
+        self.config.add_asset("Bank", "Saving", {})
+        # st.stop raises a BaseException, it must not leave the batch open
+        with self.assertRaises(KeyboardInterrupt):
+            with self.config.batch():
+                self.config.add_asset("Bank", "Fund", {})
+                raise KeyboardInterrupt()
+        self.assertEqual(self.config.asset_keys(), [("Bank", "Saving")])
+        self.config.add_asset("Bank", "Stock", {})
+        self.assertEqual(len(self.read_file()["Assets"]), 2)
+
+    def test_lock(self):
+        self.config.add_asset("Bank", "Saving", {})
+        other = threading.Thread(target=self.config.add_asset, args=("Bank", "Fund", {}))
+        with self.config.batch():
+            # a batch holds the lock, mutations of other threads wait for it
+            other.start()
+            other.join(0.1)
+            self.assertTrue(other.is_alive())
+            self.config.delete_asset("Bank", "Saving")
+        other.join()
+        self.assertEqual([a["Name"] for a in self.read_file()["Assets"]], ["Fund"])
+
+        # the version is bumped after a load, not before the config is filled
+        versions = []
+        self.config.changed = lambda: versions.append(len(self.config.asset_keys()))
+        self.config.load_from_dict({"Accounts": [{"Name": "Bank"}], "Assets": [{"Name": "Saving", "Account": "Bank"}]})
+        self.assertEqual(versions, [1])
+
+    def test_account_df(self):
+        self.config.load_from_dict({"Categories": {"Risk": ["Low", "High"], "Type": ["Cash", "Stock"]}})
+        self.config.add_asset("Bank", "Saving", {"Risk": "Low", "Type": "Cash"})
+        self.config.add_asset("Broker", "Fund", {"Risk": "High"})
+        df = self.config.account_df()
+        self.assertEqual(df.columns.tolist(), ["ACCOUNT", "SUBACCOUNT", "Risk", "Type"])
+        self.assertEqual(df.values.tolist(), [["Bank", "Saving", "Low", "Cash"], ["Broker", "Fund", "High", None]])
+
+        # unchanged assets are not touched, the config is not written when nothing changes
+        version = self.config.version
+        self.config.account_from_df(df)
+        self.assertEqual(self.config.version, version)
+        df.loc[1, "Type"] = "Stock"
+        df.loc[2] = ["Broker", "Bond", "Low", None]
+        saving = self.config.get_asset("Bank", "Saving")
+        self.config.account_from_df(df)
+        self.assertIs(self.config.get_asset("Bank", "Saving"), saving)
+        self.assertEqual(self.config.get_asset("Broker", "Fund").cats, {"Risk": "High", "Type": "Stock"})
+        self.assertEqual(self.config.get_asset("Broker", "Bond").cats, {"Risk": "Low", "Type": None})
+        self.assertEqual(self.read_file()["Assets"][1]["Category"], {"Risk": "High", "Type": "Stock"})
+
+        self.config.add_account_from_df(pd.DataFrame([["Cash", "Wallet", "Low"]], columns=["ACCOUNT", "SUBACCOUNT", "Risk"]))
+        self.assertEqual(self.config.get_asset("Cash", "Wallet").cats, {"Risk": "Low"})
+        with self.assertRaises(AssertionError):
+            self.config.add_account_from_df(pd.DataFrame([["Cash", "Wallet", "High"]], columns=["ACCOUNT", "SUBACCOUNT", "Risk"]))
+
+    def test_indexes(self):
+        self.config.load_from_dict({"Categories": {"Risk": ["Low", "High"]}, "Accounts": [{"Name": "Bank"}],
+                                    "Assets": [{"Name": "Saving", "Account": "Bank", "Category": {"Risk": "Low"}}]})
+        self.config.add_asset("Broker", "Fund", {"Risk": "High"})
+        self.config.add_asset("Broker", "Stock", {"Risk": "High"})
+        self.assertTrue(self.config.has_asset("Bank", "Saving"))
+        self.assertIs(self.config.get_asset("Broker", "Fund"), self.config.acc["Broker"]["Fund"])
+        self.assertEqual(self.config.assets_with_label("Risk", "High"), {("Broker", "Fund"), ("Broker", "Stock")})
+
+        # the indexes follow every mutation
+        self.config.delete_asset("Broker", "Stock")
+        self.config.account_from_df(pd.DataFrame([["Bank", "Saving", "High"]], columns=["ACCOUNT", "SUBACCOUNT", "Risk"]))
+        self.assertFalse(self.config.has_asset("Broker", "Stock"))
+        self.assertEqual(self.config.assets_with_label("Risk", "High"), {("Broker", "Fund"), ("Bank", "Saving")})
+        self.assertEqual(self.config.assets_with_label("Risk", "Low"), set())
+        self.config.category_from_df(pd.DataFrame([["Type", "Cash"]], columns=["Category", "Labels"]))
+        self.assertEqual(self.config.assets_with_label("Risk", "High"), set())
+        self.config.clear_config()
+        self.assertIsNone(self.config.get_asset("Broker", "Fund"))
+
+    def test_reload_if_changed(self):
+        self.config.add_asset("Bank", "Saving", {})
+        self.assertFalse(self.config.reload_if_changed())
+
+        other = FinConfig(self.config_path)
+        other.add_asset("Bank", "Fund", {})
+        # the file may be written in the same tick of mtime
+        os.utime(self.config_path, ns=(0, os.stat(self.config_path).st_mtime_ns + 1))
+        self.assertTrue(self.config.reload_if_changed())
+        self.assertEqual(self.config.asset_keys(), [("Bank", "Saving"), ("Bank", "Fund")])
+        self.assertFalse(self.config.reload_if_changed())
+
+
+if __name__ == '__main__':
+    unittest.main()
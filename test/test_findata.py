@@ -0,0 +1,260 @@
+import unittest
+import os
+import shutil
+import tempfile
+import threading
+import pandas as pd
+from src.findata import FinDataContext
+
+
+class TestFinDataContext(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.temp_dir, 'test_database.db')
+        self.data = FinDataContext(self.db_path)
+        self.data.init_db()
+
+    def tearDown(self):
+        self.data.close()
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def assert_cache_synced(self, data):
+        for cached in [data.asset_data, data.tran_data]:
+            df = cached._df.reset_index(drop=True)
+            cached.load_from_db()
+            # categories of the cache may keep values of deleted rows
+            pd.testing.assert_frame_equal(df, cached._df.reset_index(drop=True), check_dtype=False, check_categorical=False)
+
+    def test_asset_cache_write_through(self):
+        self.data.insert_asset("2024-01", "Bank", "Saving", 100, 10, 1)
+        self.data.insert_asset("2024-02", "Bank", "Saving", 200, 20, 2)
+        self.data.insert_or_update_asset("2024-2", "Bank", "Saving", 300.123, 30, 3)
+        self.data.insert_or_update_asset("2024-03", "Bank", "Fund", 50, 5, 0)
+        self.data.insert_asset("2024-05", "Bank", "Fund", 361178.265, 0.285, 1.005)
+        self.data.update_asset("2024-01", "Bank", "Saving", 110, 11, 1)
+        self.data.asset_data.batch_insert_or_update([["2024-03", "Bank", "Fund", 60, 6, 1], ["2024-04", "Bank", "Fund", 70, 7, 2]])
+        self.data.delete_asset_data("2024-01", "Bank", "Saving")
+
+        df = self.data.query_asset(date="2024-02")
+        self.assertEqual(df["NET_WORTH"].tolist(), [300.12])
+        self.assertEqual(len(self.data.query_asset(acc="Bank", sub="Fund")), 3)
+        self.assert_cache_synced(self.data)
+
+        self.data.delete_asset("Bank", "Fund")
+        self.assertTrue(self.data.query_asset(acc="Bank", sub="Fund").empty)
+        self.assert_cache_synced(self.data)
+
+    def test_tran_cache_write_through(self):
+        self.data.insert_tran("2024-01", "INCOME", 1000, "salary", "")
+        self.data.insert_tran("2024-01", "OUTLAY", 200, "food", "lunch")
+        self.data.insert_tran("2024-02", "OUTLAY", 300, "food", "")
+        # rounded alike in the database and the cache
+        self.data.insert_tran("2024-02", "OUTLAY", 361178.265, "food", "")
+        self.assertEqual(self.data.query_tran(date="2024-02")["VALUE"].tolist(), [300, 361178.27])
+        ids = self.data.query_tran(date="2024-01")["ID"].tolist()
+        self.assertEqual(ids, [2024010000, 2024010001])
+
+        self.data.delete_tran(ids[0])
+        self.assertEqual(len(self.data.query_tran()), 3)
+        self.assert_cache_synced(self.data)
+
+    def test_reindex_tran_id(self):
+        for date, value in [("2024-01", 1), ("2024-01", 2), ("2024-01", 3), ("2024-02", 4), ("2024-02", 5), ("2024-03", 6)]:
+            self.data.insert_tran(date, "OUTLAY", value, "food", "")
+        self.data.delete_tran(2024010000)
+        self.data.delete_tran(2024020000)
+
+        self.data.reindex_tran_id()
+        df = self.data.query_tran()
+        self.assertEqual(df["ID"].tolist(), [2024010000, 2024010001, 2024020000, 2024030000])
+        self.assertEqual(df["VALUE"].tolist(), [2, 3, 5, 6])
+        self.assertEqual(self.data.query_tran(date="2024-02")["VALUE"].tolist(), [5])
+        self.assert_cache_synced(self.data)
+        self.data.insert_tran("2024-01", "OUTLAY", 7, "food", "")
+        self.assertEqual(self.data.query_tran(date="2024-01")["ID"].tolist(), [2024010000, 2024010001, 2024010002])
+
+    def test_tran_id_allocation(self):
+        tran_data = self.data.tran_data
+        self.data.insert_tran("2024-01", "OUTLAY", 1, "food", "")
+        ids = tran_data.reserve_ids("2024-01", 10000)
+        self.assertEqual(ids[:2].tolist(), [2024010001, 2024010002])
+        # a month of more than 9999 records goes on in the wide format, IDs stay unique and ascending
+        self.assertEqual(ids[-2:].tolist(), [2024019999, 20240100010000])
+        df = pd.DataFrame({"ID": ids, "DATE": "2024-01", "TYPE": "OUTLAY", "VALUE": 1.0, "CAT": "food", "NOTE": ""})
+        self.data.df_to_tran(df, append=True)
+        self.assertEqual(tran_data.get_unique_id("2024-01"), 20240100010001)
+        self.assertEqual(tran_data.get_unique_id("2024-02"), 2024020000)
+
+        # the last ID of a month is used again after it is deleted, as before
+        self.data.delete_tran(20240100010000)
+        self.assertEqual(tran_data.get_unique_id("2024-01"), 20240100010000)
+        self.data.insert_tran("2024-01", "INCOME", 2, "salary", "")
+        self.assertEqual(self.data.query_tran(type="INCOME")["ID"].tolist(), [20240100010000])
+        self.assertEqual(self.data.query_tran()["ID"].nunique(), 10001)
+        self.assert_cache_synced(self.data)
+
+    def test_import_tran_csv(self):
+        self.data.insert_tran("2024-01", "INCOME", 1000, "salary", "")
+        csv_path = os.path.join(self.temp_dir, "flow.csv")
+        rows = [f"2024-{i // 10 + 1},OUTLAY,{i}.254,food,n{i}" for i in range(25)]
+        with open(csv_path, "w") as f:
+            f.write("\n".join(["DATE,TYPE,VALUE,CAT,NOTE"] + rows) + "\n")
+
+        progress = []
+        imported = self.data.tran_data.import_csv(csv_path, chunk_size=10, progress=lambda rows, fraction: progress.append((rows, fraction)))
+        self.assertEqual(imported, 25)
+        self.assertEqual(progress[-1], (25, 1.0))
+        self.assertEqual([x[0] for x in progress], [10, 20, 25])
+        df = self.data.query_tran(date="2024-01")
+        self.assertEqual(df["ID"].tolist(), list(range(2024010000, 2024010011)))
+        self.assertEqual(df["NOTE"].tolist()[:3], ["", "n0", "n1"])
+        self.assertEqual(self.data.query_tran(date="2024-03")["VALUE"].tolist()[:2], [20.25, 21.25])
+        self.assert_cache_synced(self.data)
+
+        # an invalid row anywhere in the file rolls all of the chunks back
+        with open(csv_path, "w") as f:
+            f.write("\n".join(["DATE,TYPE,VALUE,CAT"] + [f"2024-05,OUTLAY,{i},food" for i in range(20)] + ["2024-05,OUTLAY,x,food"]) + "\n")
+        with self.assertRaisesRegex(ValueError, "Invalid VALUE at line 22"):
+            self.data.import_tran_csv(csv_path)
+        self.assertEqual(len(self.data.query_tran()), 26)
+        self.assertEqual(self.data.tran_data.get_unique_id("2024-05"), 2024050000)
+        self.assert_cache_synced(self.data)
+
+    def test_query_index(self):
+        asset_data = self.data.asset_data
+
+        def expect(filter):
+            df = asset_data._df
+            return asset_data._output(df.loc[(df[list(filter)] == pd.Series(filter)).all(axis=1)])
+
+        rows = [[f"2024-{m:02d}", acc, sub, m, 0, 0] for m in range(1, 7) for acc in ["A", "B"] for sub in ["x", "y"]]
+        asset_data.batch_insert(rows)
+        filters = [{"ACCOUNT": "A", "SUBACCOUNT": "x"}, {"DATE": "2024-03"}, {"DATE": "2024-03", "ACCOUNT": "B", "SUBACCOUNT": "y"},
+                   {"DATE": "2024-03", "ACCOUNT": "B"}]
+        for filter in filters:
+            pd.testing.assert_frame_equal(asset_data._query(filter), expect(filter))
+
+        # the index follows inserts and deletes
+        self.data.insert_asset("2024-07", "A", "x", 7, 0, 0)
+        self.data.delete_asset_data("2024-02", "A", "x")
+        self.data.delete_asset("B", "y")
+        self.data.insert_asset("2024-03", "B", "y", 3, 0, 0)
+        for filter in filters:
+            pd.testing.assert_frame_equal(asset_data._query(filter), expect(filter))
+        self.assertEqual(self.data.query_asset(acc="A", sub="x")["DATE"].tolist(), ["2024-01", "2024-03", "2024-04", "2024-05", "2024-06", "2024-07"])
+        self.assertTrue(self.data.query_asset(date="2024-02", acc="A", sub="x").empty)
+
+    def test_query_panel(self):
+        rows = [["2024-01", "A", "x", 1, 1, 0], ["2024-03", "A", "x", 3, 0, 2], ["2024-02", "A", "y", 2, 2, 0], ["2024-04", "B", "z", 4, 0, 0]]
+        self.data.asset_data.batch_insert(rows)
+        dates = ["2024-01", "2024-02", "2024-03", "2024-04"]
+        assets = [("A", "x"), ("A", "y"), ("C", "w")]
+
+        # the same as reindexing every asset to dates and filling them one by one
+        expected = []
+        for acc, sub in assets:
+            df = self.data.query_asset(acc=acc, sub=sub).set_index("DATE").reindex(dates)
+            for col in ["NET_WORTH", "ACCOUNT", "SUBACCOUNT"]:
+                df[col] = df[col].ffill()
+            df[["PROFIT", "INFLOW"]] = df[["PROFIT", "INFLOW"]].fillna(0)
+            expected.append(df.reset_index().rename(columns={"index": "DATE"}))
+        expected = pd.concat(expected)
+        expected = expected[expected["DATE"].between("2024-02", "2024-03")].reset_index(drop=True)
+
+        df = self.data.query_asset_panel(dates, assets, "2024-02", "2024-03")
+        pd.testing.assert_frame_equal(df, expected, check_dtype=False)
+
+    def test_query_snapshot(self):
+        rows = [["2024-01", "A", "x", 1, 1, 1], ["2024-03", "A", "x", 3, 0, 2], ["2024-02", "A", "y", 2, 2, 5], ["2024-04", "B", "z", 4, 0, 4]]
+        self.data.asset_data.batch_insert(rows)
+
+        df = self.data.query_asset_snapshot("2024-03")
+        # the record of the date keeps its PROFIT, a record carried forward has none, B z has no record until the date
+        self.assertEqual(df[["DATE", "ACCOUNT", "SUBACCOUNT", "NET_WORTH", "INFLOW", "PROFIT"]].values.tolist(),
+                         [["2024-02", "A", "y", 2, 2, 0], ["2024-03", "A", "x", 3, 0, 2]])
+        df = self.data.query_asset_snapshot("2024-01")
+        self.assertEqual(df[["ACCOUNT", "SUBACCOUNT", "PROFIT"]].values.tolist(), [["A", "x", 1]])
+        self.assertTrue(self.data.query_asset_snapshot("2023-12").empty)
+
+    def test_monthly_summary(self):
+        self.data.asset_data.batch_insert([["2024-01", "A", "x", 100, 10, 1], ["2024-01", "A", "y", 50, 5, 0], ["2024-02", "A", "x", 120, 10, 10]])
+        self.data.insert_or_update_asset("2024-02", "A", "y", 60, 5, 5)
+        self.data.update_asset("2024-01", "A", "y", 40, 4, 0)
+        self.data.insert_asset("2024-03", "A", "x", 130, 0, 10)
+        self.data.delete_asset_data("2024-03", "A", "x")
+        self.data.insert_tran("2024-01", "INCOME", 1000, "salary", "")
+        self.data.insert_tran("2024-01", "OUTLAY", 200, "food", "")
+        self.data.insert_tran("2024-03", "OUTLAY", 300, "food", "")
+
+        df = self.data.query_monthly_summary()
+        self.assertEqual(df["DATE"].tolist(), ["2024-01", "2024-02"])
+        self.assertEqual(df["NET_WORTH"].tolist(), [140, 180])
+        self.assertEqual(df["INFLOW"].tolist(), [14, 15])
+        self.assertEqual(df["PROFIT"].tolist(), [1, 15])
+        self.assertEqual(df["INCOME"].tolist(), [1000, 0])
+        self.assertEqual(df["OUTLAY"].tolist(), [200, 0])
+        self.assertEqual(self.data.query_monthly_summary("2024-02", "2024-12")["DATE"].tolist(), ["2024-02"])
+
+        # the incrementally maintained summary is the same as a rebuilt one
+        self.data.rebuild_monthly_summary()
+        pd.testing.assert_frame_equal(self.data.query_monthly_summary(), df)
+
+    def test_month_key(self):
+        self.data.asset_data.batch_insert([["2023-12", "A", "x", 100, 10, 1], ["2024-01", "A", "x", 120, 10, 10], ["2024-02", "A", "y", 50, 5, 0]])
+        self.data.insert_tran("2024-01", "INCOME", 1000, "salary", "")
+        asset_df, tran_df = self.data.query_asset(), self.data.query_tran()
+        self.assertFalse(self.data.month_key())
+
+        self.data.convert_to_month_key()
+        self.assertTrue(self.data.month_key())
+        with self.data.db as db:
+            self.assertIn("MONTH", db.query_stored_cols("SUBACCOUNT"))
+            self.assertNotIn("DATE", db.query_stored_cols("TRAN"))
+            plan = db.exec("EXPLAIN QUERY PLAN SELECT * FROM TRAN WHERE MONTH BETWEEN 24280 AND 24290").fetchall()
+            self.assertIn("TRAN_MONTH", str(plan))
+        pd.testing.assert_frame_equal(self.data.query_asset(), asset_df)
+        pd.testing.assert_frame_equal(self.data.query_tran(), tran_df)
+
+        # the storage mode is detected when the database is opened again
+        self.data.close()
+        self.data = FinDataContext(self.db_path)
+        self.assertTrue(self.data.month_key())
+        self.data.insert_or_update_asset("2024-1", "A", "x", 130, 10, 20)
+        self.data.insert_tran("2024-01", "OUTLAY", 100, "food", "")
+        self.data.delete_asset_data("2023-12", "A", "x")
+        self.assert_cache_synced(self.data)
+        self.assertEqual(self.data.query_period_asset("2024-01", "2024-02")["NET_WORTH"].tolist(), [130, 50])
+        self.assertEqual(self.data.query_last_asset("2024-03", "A", "y")["DATE"].tolist(), ["2024-02"])
+        self.assertEqual(self.data.query_tran(date="2024-01")["ID"].tolist(), [2024010000, 2024010001])
+        self.assertEqual(self.data.query_date_range(), ("2024-01", "2024-02"))
+
+    def test_shared_by_threads(self):
+        # sessions sharing one context write and read it from their own script threads
+        errors = []
+
+        def session(n: int):
+            try:
+                for i in range(20):
+                    self.data.insert_or_update_asset(f"2024-{i % 12 + 1}", "A", f"s{n}", i, 0, 0)
+                    self.data.insert_tran("2024-01", "OUTLAY", i, "food", "")
+                    self.data.query_asset(acc="A", sub=f"s{n}")
+                    self.data.query_asset_snapshot("2024-06")
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=session, args=(n,)) for n in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(len(self.data.query_asset()), 4 * 12)
+        # tran IDs are allocated and inserted atomically
+        self.assertEqual(self.data.query_tran()["ID"].nunique(), 80)
+        self.assert_cache_synced(self.data)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,7 +2,8 @@ import unittest
 import sqlite3
 import os
 import tempfile
-from src.findatasql import FinDataSQL, SQLTableDef, SQLColDef
+import pandas as pd
+from src.findatasql import FinDataSQL, SQLTableDef, SQLColDef, SQLIndexDef, SQLMigration, SQLTracer, CSVLoadError
 
 
 class TestFinDataSQL(unittest.TestCase):
@@ -20,9 +21,9 @@ class TestFinDataSQL(unittest.TestCase):
                                        SQLColDef("age", "INTEGER")])
 
     def tearDown(self):
-        # Close the database connection
+        # Close the database connections
         if hasattr(self, 'fin_data_sql'):
-            self.fin_data_sql.db.close()
+            self.fin_data_sql.close()
 
         # Remove the temporary directory and its contents
         if os.path.exists(self.temp_dir):
@@ -145,6 +146,198 @@ class TestFinDataSQL(unittest.TestCase):
             self.assertEqual(result_all_types[1][1:], ("2023-02-01", "A", 200.0))
             self.assertEqual(result_all_types[2][1:], ("2023-02-15", "B", 250.0))
 
+    def test_connection_pool(self):
+        with self.fin_data_sql:
+            conn = self.fin_data_sql.db
+            self.fin_data_sql.create_table(self.test_table)
+            self.fin_data_sql.commit()
+
+            # nested blocks share the borrowed connection
+            with self.fin_data_sql:
+                self.assertIs(self.fin_data_sql.db, conn)
+        self.assertIsNone(self.fin_data_sql.db)
+
+        # the connection is reused by the next block, with PRAGMAs applied
+        with self.fin_data_sql:
+            self.assertIs(self.fin_data_sql.db, conn)
+            self.assertEqual(self.fin_data_sql.exec("PRAGMA journal_mode").fetchone()[0], "wal")
+            self.assertIn(('test_table',), self.fin_data_sql.get_tables())
+
+    def test_uncommitted_data_is_dropped(self):
+        with self.fin_data_sql:
+            self.fin_data_sql.create_table(self.test_table)
+            self.fin_data_sql.commit()
+            self.fin_data_sql.insert_data({"id": 1, "name": "John Doe", "age": 30}, self.test_table)
+
+        with self.fin_data_sql:
+            self.assertTrue(self.fin_data_sql.empty(self.test_table))
+
+    def test_insert_many(self):
+        table = SQLTableDef("fmt_table", [
+            SQLColDef("id", "INTEGER", "PRIMARY KEY"),
+            SQLColDef("name", "TEXT", "NOT NULL", str.upper),
+            SQLColDef("value", "REAL", "NOT NULL", lambda x: round(x, 1), lambda x: x.round(1))
+        ])
+        with self.fin_data_sql:
+            self.fin_data_sql.create_table(table)
+
+            # rows as dicts, sequences and a DataFrame, in chunks smaller than the input
+            rows = [{"id": i, "name": f"n{i}", "value": i + 0.123} for i in range(5)]
+            self.assertEqual(self.fin_data_sql.insert_many(rows, table, chunk_size=2), 5)
+            self.fin_data_sql.insert_many([(5, "n5", 5.55)], table)
+            df = pd.DataFrame({"value": [6.06, 7.07], "id": [6, 7], "name": ["n6", "n7"]})
+            self.fin_data_sql.insert_many(df, table, chunk_size=1)
+            self.fin_data_sql.commit()
+
+            result = self.fin_data_sql.query_all(table)
+            self.assertEqual(len(result), 8)
+            self.assertEqual(result[0], (0, "N0", 0.1))
+            self.assertEqual(result[7], (7, "N7", 7.1))
+
+    def test_load_from_csv(self):
+        csv_path = os.path.join(self.temp_dir, "rows.csv")
+
+        def write_csv(bad_row: int = None):
+            with open(csv_path, "w") as f:
+                f.write("id,name,age\n")
+                for i in range(10):
+                    f.write(f"{i},n{i},{'x' if i == bad_row else i}\n")
+
+        def count():
+            return len(self.fin_data_sql.query_all(self.test_table))
+
+        with self.fin_data_sql:
+            self.fin_data_sql.create_table(self.test_table)
+            write_csv()
+            progress = []
+            loaded, skipped = self.fin_data_sql.load_from_csv(csv_path, self.test_table, chunk_size=4, progress=lambda *x: progress.append(x))
+            self.assertEqual((loaded, skipped), (10, []))
+            self.assertEqual([x[0] for x in progress], [4, 8, 10])
+            self.assertEqual(progress[-1][1:], (os.path.getsize(csv_path), os.path.getsize(csv_path)))
+            self.assertEqual(self.fin_data_sql.query_data({"id": 9}, self.test_table), [(9, "n9", 9)])
+
+            # a bad chunk undoes the whole load, or only itself
+            self.fin_data_sql.exec("DELETE FROM test_table")
+            self.fin_data_sql.commit()
+            write_csv(bad_row=5)
+            with self.assertRaises(CSVLoadError):
+                self.fin_data_sql.load_from_csv(csv_path, self.test_table, chunk_size=4)
+            self.assertEqual(count(), 0)
+            loaded, skipped = self.fin_data_sql.load_from_csv(csv_path, self.test_table, chunk_size=4, on_error="skip")
+            self.assertEqual((loaded, [x[0] for x in skipped]), (6, [4]))
+            self.assertEqual(count(), 6)
+
+            # a stopped load keeps the chunks before and is resumed from the failed chunk
+            self.fin_data_sql.exec("DELETE FROM test_table")
+            self.fin_data_sql.commit()
+            with self.assertRaises(CSVLoadError) as e:
+                self.fin_data_sql.load_from_csv(csv_path, self.test_table, chunk_size=4, on_error="stop")
+            self.assertEqual((e.exception.row, e.exception.loaded, count()), (4, 4, 4))
+            write_csv()
+            loaded, _ = self.fin_data_sql.load_from_csv(csv_path, self.test_table, chunk_size=4, start_row=e.exception.row)
+            self.assertEqual((loaded, count()), (6, 10))
+
+    def test_upsert_many(self):
+        cols = [SQLColDef("date", "TEXT", "NOT NULL"), SQLColDef("name", "TEXT", "NOT NULL"), SQLColDef("value", "REAL")]
+        table = SQLTableDef("upsert_table", cols, ["date", "name"])
+        with self.fin_data_sql:
+            self.fin_data_sql.create_table(table)
+            self.fin_data_sql.upsert_many([("2024-01", "a", 1.0), ("2024-01", "b", 2.0)], table)
+            self.fin_data_sql.upsert_many([("2024-01", "a", 3.0), ("2024-02", "a", 4.0)], table)
+            self.fin_data_sql.insert_or_update({"date": "2024-01", "name": "b"}, {"value": 5.0}, table)
+            self.fin_data_sql.commit()
+
+            result = self.fin_data_sql.query_all(table)
+            self.assertEqual(result, [("2024-01", "a", 3.0), ("2024-01", "b", 5.0), ("2024-02", "a", 4.0)])
+
+    def test_ensure_unique(self):
+        cols = [SQLColDef("date", "TEXT", "NOT NULL"), SQLColDef("name", "TEXT", "NOT NULL"), SQLColDef("value", "REAL")]
+        old_table = SQLTableDef("upsert_table", cols)
+        table = SQLTableDef("upsert_table", cols, ["date", "name"])
+        with self.fin_data_sql:
+            # a table created before the unique key was declared, with duplicated keys
+            self.fin_data_sql.create_table(old_table)
+            self.fin_data_sql.insert_many([("2024-01", "a", 1.0), ("2024-01", "b", 2.0), ("2024-01", "a", 3.0)], old_table)
+
+            with self.assertLogs("src.findatasql", "WARNING") as logs:
+                self.assertTrue(self.fin_data_sql.ensure_unique(table))
+            self.assertIn("Removing 1 duplicated rows of upsert_table", logs.output[0])
+            self.assertIn("('2024-01', 'a')", logs.output[0])
+            self.assertFalse(self.fin_data_sql.ensure_unique(table))
+            self.fin_data_sql.upsert_many([("2024-01", "b", 4.0)], table)
+            self.fin_data_sql.commit()
+
+            result = self.fin_data_sql.query_all(table)
+            self.assertEqual(sorted(result), [("2024-01", "a", 3.0), ("2024-01", "b", 4.0)])
+
+    def test_create_table_with_indexes(self):
+        cols = [SQLColDef("date", "TEXT", "NOT NULL"), SQLColDef("name", "TEXT", "NOT NULL"), SQLColDef("value", "REAL")]
+        table = SQLTableDef("index_table", cols, indexes=[SQLIndexDef("index_table_name_date", ["name", "date"])])
+        with self.fin_data_sql:
+            self.fin_data_sql.create_table(table)
+            indexes = [x[1] for x in self.fin_data_sql.exec("PRAGMA index_list(index_table)").fetchall()]
+            self.assertIn("index_table_name_date", indexes)
+
+            plan = self.fin_data_sql.exec_value("EXPLAIN QUERY PLAN SELECT * FROM index_table WHERE date BETWEEN ? AND ? AND name = ?",
+                                                ["2024-01", "2024-06", "a"]).fetchall()
+            self.assertIn("USING INDEX index_table_name_date", " ".join([x[-1] for x in plan]))
+
+    def test_migrate(self):
+        applied_steps = []
+
+        def step(version):
+
+            def upgrade(db: FinDataSQL):
+                applied_steps.append(version)
+                db.exec(f"CREATE TABLE t{version} (id INTEGER)")
+
+            return SQLMigration(version, f"step {version}", upgrade)
+
+        def fail(db: FinDataSQL):
+            db.exec("CREATE TABLE t_fail (id INTEGER)")
+            raise RuntimeError("bad migration")
+
+        with self.fin_data_sql:
+            self.assertEqual(self.fin_data_sql.user_version(), 0)
+            applied = self.fin_data_sql.migrate([step(2), step(1)])
+            self.assertEqual([m.version for m in applied], [1, 2])
+            self.assertEqual(self.fin_data_sql.user_version(), 2)
+
+            # only new steps run, a failed step is rolled back and keeps the version
+            with self.assertRaises(RuntimeError):
+                self.fin_data_sql.migrate([step(1), step(2), step(3), SQLMigration(4, "fail", fail)])
+            self.assertEqual(applied_steps, [1, 2, 3])
+            self.assertEqual(self.fin_data_sql.user_version(), 3)
+            self.assertNotIn(("t_fail",), self.fin_data_sql.get_tables())
+
+    def test_tracer(self):
+        tracer = self.fin_data_sql.tracer
+        self.assertEqual(tracer.level, SQLTracer.OFF)
+        with self.fin_data_sql:
+            self.fin_data_sql.create_table(self.test_table)
+            self.assertTrue(tracer.records_df().empty)
+
+            tracer.level = SQLTracer.STATEMENT
+            self.fin_data_sql.insert_data({"id": 1, "name": "John Doe", "age": 30}, self.test_table)
+            self.fin_data_sql.insert_data({"id": 2, "name": "Jane Doe", "age": 31}, self.test_table)
+            self.fin_data_sql.query_data({"id": 1}, self.test_table)
+
+            # literals are not recorded, the two inserts share one histogram
+            records = tracer.records_df()
+            self.assertEqual(len(records), 3)
+            self.assertNotIn("John", " ".join(records["STATEMENT"]))
+            self.assertTrue(records["VALUES"].isna().all())
+            self.assertEqual(tracer.histogram_df()["COUNT"].tolist(), [2, 1])
+
+            tracer.level = SQLTracer.VALUES
+            self.fin_data_sql.query_data({"id": 2}, self.test_table)
+            self.assertEqual(tracer.records_df()["VALUES"].iloc[-1], "[2]")
+
+            tracer.clear()
+            tracer.sample_rate = 0
+            self.fin_data_sql.query_data({"id": 2}, self.test_table)
+            self.assertTrue(tracer.records_df().empty)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,40 @@
+import unittest
+import numpy as np
+import pandas as pd
+import src.finutils as fu
+
+
+class TestFinUtils(unittest.TestCase):
+
+    def test_date(self):
+        for date in ["2024-1", "2024-01", "2024-12-31", "2024/3", "1999-12"]:
+            p = pd.Period(date, freq="M")
+            self.assertEqual(fu.norm_date(date), p.strftime("%Y-%m"))
+            self.assertEqual(fu.digit_date(date), int(p.strftime("%Y%m")))
+            self.assertEqual(fu.prev_date(date), (p - 1).strftime("%Y-%m"))
+            self.assertEqual(fu.next_date(date), (p + 1).strftime("%Y-%m"))
+        self.assertEqual(fu.get_date(2024, 1), "2024-01")
+        self.assertRaises(ValueError, fu.get_date, 2024, 13)
+
+    def test_date_range(self):
+        for s, e in [("2020-03", "2024-02"), ("2024-01", "2024-01"), ("2024-05", "2024-01")]:
+            self.assertEqual(fu.date_list(s, e), [p.strftime("%Y-%m") for p in pd.period_range(s, e, freq="M")])
+            self.assertEqual(fu.year_list(s, e), [p.year for p in pd.period_range(s, e, freq="Y")])
+
+        # the cached range is not shared with callers
+        fu.date_list("2024-01", "2024-03").append("2024-04")
+        self.assertEqual(fu.date_list("2024-01", "2024-03"), ["2024-01", "2024-02", "2024-03"])
+
+    def test_date_series(self):
+        dates = pd.Series(["2024-1", "2023-12", "2024-01-15"], index=[5, 6, 7])
+        pd.testing.assert_series_equal(fu.norm_date_series(dates), pd.Series(["2024-01", "2023-12", "2024-01"], index=[5, 6, 7]))
+        pd.testing.assert_series_equal(fu.digit_date_series(dates), pd.Series([202401, 202312, 202401], index=[5, 6, 7]))
+        self.assertTrue(fu.norm_date_series(pd.Series([], dtype=object)).empty)
+        with self.assertRaises(ValueError):
+            fu.norm_date_series(pd.Series(["2024-01", None, "2024-03"]))
+        with self.assertRaises(ValueError):
+            fu.digit_date_series(pd.Series([np.nan, np.nan]))
+
+
+if __name__ == '__main__':
+    unittest.main()